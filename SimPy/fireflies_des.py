@@ -1,21 +1,145 @@
-import pygame
 import simpy
+from heapq import heappop, heappush
+from itertools import count
 from random import sample, randint, randrange
-from math import sqrt
+from lib.neighbors import CSRAdjacency, neighbor_pairs
+from lib.render import init_display, quit_display
 from time import sleep
 
 const_black = (0, 0, 0)
 const_white = (255, 255, 255)
 
 
+# Event scheduler running the firefly model headless and as fast as possible
+# It follows the SimPy processes of FirefliesSimulation: a firefly lights up at next_blink_at,
+# stays lit for blink_duration, then messages its neighbors and schedules its next blink
+# a period later. A message nudges the pending blink once per time step (last_nudged),
+# never to before the current time. The first blink runs to completion, and the messages
+# received until it ends nudge the firefly right after it. As with the SimPy processes,
+# every blink which completes leaves a Store getter behind, which swallows the next
+# message sent to the firefly, so both runs flash at the same times.
+# Every firefly has a single pending event in the heap; rescheduling it bumps the
+# firefly's version, and events of older versions are dropped when they come up.
+class FlashScheduler:
+    light_up_event = 0
+    light_off_event = 1
+    message_event = 2
+
+    def __init__(self, adjacency, period, nudge, blink_duration, starts):
+        self.n = len(starts)
+        self.p = period
+        self.nudge = nudge
+        self.blink_duration = blink_duration
+        self.indptr = adjacency.indptr.tolist()
+        self.indices = adjacency.indices.tolist()
+
+        self.now = 0
+        self.queue = []
+        self.sequence = count()
+        self.next_blink_at = list(starts)
+        self.last_nudged = [0] * self.n
+        self.version = [0] * self.n
+        self.first_round = [True] * self.n
+        self.pending = [False] * self.n
+        self.swallowed = [0] * self.n
+
+        # Flashes so far, and the first time all the fireflies lit up together
+        self.flash_count = 0
+        self.lit_at = [None] * self.n
+        self.flash_time = None
+        self.flashing = 0
+        self.synchronized_at = None
+
+        # Called as on_flash(time, i) every time a firefly lights up
+        self.on_flash = None
+
+        for i in range(self.n):
+            self.schedule(self.next_blink_at[i], self.light_up_event, i)
+
+    # Private method to push an event of a firefly into the heap
+    def schedule(self, time, kind, i):
+        heappush(self.queue, (time, next(self.sequence), kind, i, self.version[i]))
+
+    # Private method to nudge the pending blink of a firefly which received a message
+    def nudge_firefly(self, i):
+        if self.last_nudged[i] == self.now:
+            return
+        if self.next_blink_at[i] - self.nudge > self.now:
+            self.next_blink_at[i] -= self.nudge
+        else:
+            self.next_blink_at[i] = self.now
+        self.last_nudged[i] = self.now
+
+        # Replace the pending event (a blink in progress is cut short)
+        self.version[i] += 1
+        self.schedule(self.next_blink_at[i], self.light_up_event, i)
+
+    # Process the events before until (all of them if until is None)
+    # With stop_on_sync=True the run stops once all the fireflies lit up together
+    def run(self, until=None, stop_on_sync=False):
+        queue = self.queue
+        while queue:
+            time, _, kind, i, version = queue[0]
+            if until is not None and time >= until:
+                break
+            if stop_on_sync and self.synchronized_at is not None:
+                break
+            heappop(queue)
+            self.now = time
+
+            if kind == self.message_event:
+                for j in self.indices[self.indptr[i]:self.indptr[i + 1]]:
+                    if self.first_round[j]:
+                        self.pending[j] = True
+                    elif self.swallowed[j] > 0:
+                        self.swallowed[j] -= 1
+                    else:
+                        self.nudge_firefly(j)
+            elif version != self.version[i]:
+                continue
+            elif kind == self.light_up_event:
+                self.flash_count += 1
+                if self.on_flash is not None:
+                    self.on_flash(time, i)
+                if self.lit_at[i] != time:
+                    self.lit_at[i] = time
+                    if self.flash_time != time:
+                        self.flash_time = time
+                        self.flashing = 0
+                    self.flashing += 1
+                    if self.flashing == self.n and self.synchronized_at is None:
+                        self.synchronized_at = time
+                self.schedule(time + self.blink_duration, self.light_off_event, i)
+            else:
+                # Turn off the light, message the neighbors and wait for the next blink
+                self.schedule(time, self.message_event, i)
+                self.next_blink_at[i] = time + self.p
+                self.schedule(self.next_blink_at[i], self.light_up_event, i)
+                if self.first_round[i]:
+                    self.first_round[i] = False
+                    if self.pending[i]:
+                        self.pending[i] = False
+                        self.nudge_firefly(i)
+                else:
+                    self.swallowed[i] += 1
+
+        if until is not None and not (stop_on_sync and self.synchronized_at is not None):
+            self.now = until
+
+
 class FirefliesSimulation:
-    def __init__(self, number_of_fireflies, period=20, nudge=4, neighbor_distance=50):
+    # With headless=True nothing is drawn and the model runs on a FlashScheduler
+    # instead of the realtime SimPy environment
+    def __init__(self, number_of_fireflies, period=20, nudge=4, neighbor_distance=50, headless=False,
+                 canvas_length=1600, canvas_width=800):
         # Save the parameters of the simulation
         self.n = number_of_fireflies
         self.p = period
         self.blink_duration = 1
-        self.canvas_length = 1600               # Default is 1600
-        self.canvas_width = 800                 # Default is 800
+        self.canvas_length = canvas_length      # Default is 1600
+        self.canvas_width = canvas_width        # Default is 800
+        self.headless = headless
+        self.scheduler = None
         self.nudge = nudge
         self.neighbor_distance = neighbor_distance
         self.message_pipes = {}
@@ -27,25 +151,27 @@ class FirefliesSimulation:
         # Initialize the positions of fireflies
         xs = sample(range(self.canvas_length), self.n)
         ys = sample(range(self.canvas_width), self.n)
-        self.fireflies_positions = zip(xs, ys)
+        self.fireflies_positions = list(zip(xs, ys))
+
+        firsts, seconds = neighbor_pairs(xs, ys, self.neighbor_distance)
+        print("Average neighbors: {0}".format(len(firsts) / float(self.n)))
+
+        if headless:
+            # Same random starts, drawn in the same order as for the SimPy processes
+            starts = [randint(1, self.p) for _ in self.fireflies_positions]
+            adjacency = CSRAdjacency.from_pairs(self.n, firsts, seconds)
+            self.scheduler = FlashScheduler(adjacency, self.p, self.nudge, self.blink_duration, starts)
+            return
 
         # Initialize the neighbors dictionary
         for x, y in self.fireflies_positions:
             self.neighbors[(x, y)] = []
-        for x1, y1 in self.fireflies_positions:
-            for x2, y2 in self.fireflies_positions:
-                if (x1, y1) != (x2, y2) and sqrt((x2 - x1)**2 + (y2 - y1)**2) < self.neighbor_distance:
-                    self.neighbors[(x1, y1)].append((x2, y2))
-        neighbor_counts = [len(self.neighbors[i]) for i in self.neighbors]
-        print "Average neighbors:", sum(neighbor_counts) / float(len(neighbor_counts))
+        for i, j in zip(firsts.tolist(), seconds.tolist()):
+            self.neighbors[self.fireflies_positions[i]].append(self.fireflies_positions[j])
 
-        # Initialize pygame library
-        pygame.init()
-        self.space = pygame.display.set_mode((self.canvas_length, self.canvas_width))
-        pygame.display.set_caption('Fireflies')
-
-        # Set the background color as black
-        self.space.fill(const_black)
+        # Initialize pygame library (only loaded when the model is shown)
+        self.renderer = init_display(self.canvas_length, self.canvas_width)
+        self.space = self.renderer.surface
 
         # Initialize SimPy environment
         self.simpy_env = simpy.RealtimeEnvironment(factor=0.1)
@@ -95,14 +221,14 @@ class FirefliesSimulation:
             # sleep(wait)
 
             # Light up
-            self.__light_up_firefly(self.space, x, y)
+            self.renderer.draw([x], [y])
 
             # Wait for a brief duration (blink)
             yield self.simpy_env.timeout(self.blink_duration)
             # sleep(0.1)
 
             # Turn off the light
-            self.__turn_off_firefly(self.space, x, y)
+            self.renderer.erase([x], [y])
 
             # Trigger the events of neighbors
             for neighbor in self.neighbors[(x, y)]:
@@ -111,27 +237,14 @@ class FirefliesSimulation:
         except simpy.Interrupt as i:
             pass
 
-    # Private method to light up the firefly
-    @staticmethod
-    def __light_up_firefly(game_display, location_x, location_y):
-        for x in range(location_x - 3, location_x + 3):
-            for y in range(location_y - 3, location_y + 3):
-                game_display.set_at((abs(x), abs(y)), const_white)
-        pygame.display.update()
-
-    # Private method to turn off the firefly
-    @staticmethod
-    def __turn_off_firefly(game_display, location_x, location_y):
-        for x in range(location_x - 3, location_x + 3):
-            for y in range(location_y - 3, location_y + 3):
-                game_display.set_at((abs(x), abs(y)), const_black)
-        pygame.display.update()
-
     # To start the simpy simulation
-    def start_simulation(self):
-        self.simpy_env.run()
+    def start_simulation(self, until=None):
+        if self.headless:
+            self.scheduler.run(until)
+        else:
+            self.simpy_env.run(until)
 
     # Exit the simulation
     @staticmethod
     def exit_simulation():
-        pygame.quit()
+        quit_display()
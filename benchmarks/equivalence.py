@@ -0,0 +1,130 @@
+# Seeded equivalence check of the ways to run a model
+#
+# Every case builds the same replicates of a model from a fixed seed and runs them on the
+# firefly objects, the ArrayEngine and the PartitionedEngine (both stepping every tick and
+# skipping idle ticks) and the EnsembleEngine. The logs, the final state of the fireflies and
+# the outcome of every run must be exactly those of the firefly objects: a case which differs
+# prints its first difference, and the check exits with status 1, e.g.
+#
+#   python benchmarks/equivalence.py --models linear strogatzian --until 1000
+#
+# Every run is checked with a log of every tick, a decimated log (every 7th tick) and no log,
+# as the stats are only computed for the ticks whose rows are kept (see --log-every, 0 being
+# no log). The ensemble keeps no log and is checked once.
+#
+# The ensemble moves the fireflies of its replicates in turns, so it draws a different
+# random sequence than one replicate after the other: it is only checked without movement.
+
+import os
+import random
+import sys
+from argparse import ArgumentParser
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+from scaling import build_simulation
+from lib.ensemble import EnsembleEngine
+from lib.runlog import RunLog
+
+models = ('base', 'linear', 'strogatzian', 'adversarial')
+engines = ('vectorized', 'skipping', 'partitioned', 'partitioned-skipping', 'ensemble')
+
+
+# Run log keeping its rows in memory
+class MemoryRunLog(RunLog):
+    def open(self, param_string):
+        self.kept = []
+
+    def write_rows(self, rows):
+        self.kept.extend(tuple(row) for row in rows)
+
+
+# Build the replicates of a case, always from the same seed
+def build_replicates(case):
+    random.seed(case['seed'])
+    return [build_simulation(case['model'], case['n'], case['neighbor_distance'], case['movement'])
+            for _ in range(case['replicates'])]
+
+
+# Outcome of a run: its log rows (None when it wasn't logged) and final state
+def outcome(sim, rows=None):
+    state = [(firefly.x, firefly.y, firefly.clock, firefly.last_nudged_at) for firefly in sim.fireflies]
+    return {'time': sim.time, 'synchronized_at': sim.synchronized_at, 'phase_metric': sim.phase_metric,
+            'state': state, 'rows': rows}
+
+
+# Run the replicates of a case on an engine (or on the firefly objects), logging every
+# `every` ticks (not at all if every is 0)
+# This method returns the outcome of every replicate
+def run_replicates(case, engine, every=1):
+    simulations = build_replicates(case)
+    if engine == 'ensemble':
+        EnsembleEngine(simulations).run(case['until'])
+        return [outcome(sim) for sim in simulations]
+
+    options = {'vectorized': engine != 'objects', 'skip_idle': engine.endswith('skipping'),
+               'processes': case['processes'] if engine.startswith('partitioned') else None}
+    outcomes = []
+    for sim in simulations:
+        run_log = MemoryRunLog(flush_every=1000, every=every) if every > 0 else None
+        sim.start_simulation(until=case['until'], log=run_log, verbose=False, **options)
+        outcomes.append(outcome(sim, run_log.kept if run_log is not None else None))
+    return outcomes
+
+
+# First difference between the outcomes of a run and the reference (logged every tick),
+# None if they are the same; the rows of a run logged every `every` ticks are compared
+# to the reference rows it should have kept
+def difference(reference, outcomes, every=1):
+    for replicate, (expected, actual) in enumerate(zip(reference, outcomes)):
+        expected = dict(expected, rows=[row for row in expected['rows'] if row[0] % every == 0])
+        for key in ('time', 'synchronized_at', 'phase_metric', 'state', 'rows'):
+            if key == 'rows' and actual[key] is None:
+                continue
+            if expected[key] == actual[key]:
+                continue
+            if key in ('state', 'rows'):
+                for k, (a, b) in enumerate(zip(expected[key], actual[key])):
+                    if a != b:
+                        return "replicate {0} {1}[{2}]: {3!r} != {4!r}".format(replicate, key, k, a, b)
+                return "replicate {0} {1}: {2} != {3} entries".format(replicate, key, len(expected[key]),
+                                                                      len(actual[key]))
+            return "replicate {0} {1}: {2!r} != {3!r}".format(replicate, key, expected[key], actual[key])
+    return None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check that the engines reproduce the firefly objects exactly")
+    parser.add_argument('--models', nargs='+', choices=models, default=list(models))
+    parser.add_argument('--engines', nargs='+', choices=engines, default=list(engines))
+    parser.add_argument('--movement', choices=['off', 'on', 'both'], default='both')
+    parser.add_argument('--n', type=int, default=100)
+    parser.add_argument('--distance', type=int, default=150)
+    parser.add_argument('--replicates', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--until', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-every', nargs='+', type=int, default=[1, 7, 0])
+    args = parser.parse_args()
+
+    mismatches = 0
+    for model in args.models:
+        for movement in {'off': [False], 'on': [True], 'both': [False, True]}[args.movement]:
+            case = {'model': model, 'n': args.n, 'neighbor_distance': args.distance, 'movement': movement,
+                    'replicates': args.replicates, 'processes': args.processes, 'until': args.until,
+                    'seed': args.seed}
+            reference = run_replicates(case, 'objects')
+            for engine in args.engines:
+                if movement and engine in ('skipping', 'partitioned-skipping', 'ensemble'):
+                    continue
+                for every in args.log_every[:1] if engine == 'ensemble' else args.log_every:
+                    found = difference(reference, run_replicates(case, engine, every), max(every, 1))
+                    if found is not None:
+                        mismatches += 1
+                    logged = "every {0}".format(every) if every > 0 else "none"
+                    print("{0:<12} move={1:<5} {2:<20} log={3:<8} {4}".format(
+                        model, str(movement), engine, logged, "ok" if found is None else "MISMATCH " + found))
+
+    if mismatches > 0:
+        sys.exit(1)
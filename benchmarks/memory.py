@@ -0,0 +1,39 @@
+# Memory taken by the fireflies and their neighbors, per firefly and per edge
+#
+# Builds the linear model at every population and neighbor distance, prints its memory
+# report (see lib.memory) and, with --target, the memory a population of that size would
+# take on the same canvas: the number of edges grows with the square of the population, e.g.
+#
+#   python benchmarks/memory.py --sizes 400 800 --distances 50 150 --target 100000
+
+import os
+import random
+import sys
+from argparse import ArgumentParser
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+from fireflies_linear import LinearFirefliesSimulation
+from lib.memory import estimate_bytes, format_memory_report, memory_report
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Report the memory per firefly and per neighbor edge")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 400, 800])
+    parser.add_argument('--distances', type=int, nargs='+', default=[50, 150])
+    parser.add_argument('--target', type=int, nargs='*', default=[])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        for neighbor_distance in args.distances:
+            random.seed(args.seed)
+            sim = LinearFirefliesSimulation(n_fireflies=n, neighbor_distance=neighbor_distance)
+            report = memory_report(sim)
+            print("n={0} d={1}".format(n, neighbor_distance))
+            print(format_memory_report(report))
+            for target in args.target:
+                edges = int(report['edges'] * (float(target) / n) * (target - 1) / max(1, n - 1))
+                print("  {0} fireflies, ~{1} edges: ~{2:,} bytes".format(
+                    target, edges, estimate_bytes(report, target, edges)))
+            print("")
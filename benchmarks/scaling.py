@@ -0,0 +1,212 @@
+# Scaling benchmarks of the firefly models
+#
+# Every case (model, population, neighbor distance, movement, engine) runs headless with a
+# fixed seed in its own interpreter, so the peak memory of each case is its own. A case
+# reports its ticks per second, the time to build the neighbors from scratch and the time
+# spent rebuilding them during the run, the peak resident memory and when (and how fast)
+# the population synchronized. The results are written as JSON, and a run can be compared
+# with an earlier one to catch regressions, e.g.:
+#
+#   python benchmarks/scaling.py --output new.json --compare old.json
+#
+# The SimPy model runs on its headless scheduler and has no movement nor engines.
+
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from argparse import SUPPRESS, ArgumentParser
+from time import strftime, time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, 'SimPy')]
+
+models = ('base', 'linear', 'strogatzian', 'adversarial', 'simpy')
+
+
+# Build a simulation of one of the models of lib
+def build_simulation(model, n, neighbor_distance, movement):
+    if model == 'base':
+        from lib.firefly import Firefly, FirefliesSimulation
+        sim = FirefliesSimulation(n_fireflies=n, neighbor_distance=neighbor_distance, movement=movement)
+        xs = random.sample(range(sim.canvas_length), n)
+        ys = random.sample(range(sim.canvas_width), n)
+        sim.fireflies = [Firefly(x=xs[k], y=ys[k], period=50) for k in range(n)]
+        sim.update_firefly_neighbors()
+        return sim
+    if model == 'linear':
+        from fireflies_linear import LinearFirefliesSimulation
+        return LinearFirefliesSimulation(n_fireflies=n, neighbor_distance=neighbor_distance, movement=movement)
+    if model == 'strogatzian':
+        from fireflies_strogatzian import StrogatzianFirefliesSimulation
+        return StrogatzianFirefliesSimulation(n_fireflies=n, neighbor_distance=neighbor_distance, movement=movement)
+    if model == 'adversarial':
+        from fireflies_adversarial import AdversarialFirefliesSimulation
+        return AdversarialFirefliesSimulation(n_fireflies=n, neighbor_distance=neighbor_distance, movement=movement)
+    raise ValueError("Unknown model: {0}".format(model))
+
+
+# Run one case in this process and return its measurements
+def run_case(case):
+    random.seed(case['seed'])
+    result = dict(case)
+
+    if case['model'] == 'simpy':
+        from fireflies_des import FirefliesSimulation
+        from lib.neighbors import neighbor_pairs
+        started = time()
+        sim = FirefliesSimulation(case['n'], neighbor_distance=case['neighbor_distance'], headless=True)
+        result['build_seconds'] = time() - started
+
+        xs = [x for x, y in sim.fireflies_positions]
+        ys = [y for x, y in sim.fireflies_positions]
+        started = time()
+        firsts, seconds = neighbor_pairs(xs, ys, case['neighbor_distance'])
+        result['neighbor_build_seconds'] = time() - started
+        result['edges'] = len(firsts)
+
+        started = time()
+        sim.scheduler.run(case['until'], stop_on_sync=True)
+        result['run_seconds'] = time() - started
+        result['ticks'] = sim.scheduler.now
+        result['neighbor_seconds'] = 0.0
+        result['synchronized_at'] = sim.scheduler.synchronized_at
+    else:
+        started = time()
+        sim = build_simulation(case['model'], case['n'], case['neighbor_distance'], case['movement'])
+        result['build_seconds'] = time() - started
+
+        sim.grid = None
+        started = time()
+        sim.update_firefly_neighbors()
+        result['neighbor_build_seconds'] = time() - started
+
+        sim.start_simulation(until=case['until'], vectorized=case['engine'] == 'vectorized', log=None,
+                             verbose=False, profile=True)
+        result['run_seconds'] = sim.profiler.elapsed
+        result['ticks'] = sim.time
+        result['neighbor_seconds'] = sim.profiler.seconds['neighbors']
+        result['edges'] = sim.profiler.counters['edges']
+        result['synchronized_at'] = sim.synchronized_at
+
+    result['ticks_per_second'] = result['ticks'] / result['run_seconds'] if result['run_seconds'] > 0 else None
+    result['seconds_to_sync'] = None if result['synchronized_at'] is None else result['run_seconds']
+
+    # Kilobytes on Linux (bytes on macOS)
+    import resource
+    result['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+# Run a case in a new interpreter
+def measure(case):
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                     cwd=root, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+# All the cases of the suite
+def benchmark_cases(args):
+    cases = []
+    for model in args.models:
+        for n in args.sizes:
+            for neighbor_distance in args.distances:
+                movements = [False] if model == 'simpy' else args.movement
+                engines = ['scheduler'] if model == 'simpy' else args.engines
+                for movement in movements:
+                    for engine in engines:
+                        cases.append({'model': model, 'n': n, 'neighbor_distance': neighbor_distance,
+                                      'movement': movement, 'engine': engine, 'until': args.until,
+                                      'seed': args.seed})
+    return cases
+
+
+# Key identifying a case across result files
+def case_key(case):
+    return (case['model'], case['n'], case['neighbor_distance'], case['movement'], case['engine'],
+            case['until'], case['seed'])
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root, stderr=subprocess.STDOUT)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print how the ticks per second changed since a baseline result file
+# This method returns the number of cases which got slower than the tolerance allows
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = dict((case_key(result), result) for result in json.load(f)['results'])
+
+    regressions = 0
+    for result in results:
+        before = baseline.get(case_key(result))
+        if before is None or not before['ticks_per_second'] or not result['ticks_per_second']:
+            continue
+        ratio = result['ticks_per_second'] / before['ticks_per_second']
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{0:<12} n={1:<5} d={2:<4} move={3:<5} {4:<10} {5:6.2f}x{6}".format(
+            result['model'], result['n'], result['neighbor_distance'], str(result['movement']),
+            result['engine'], ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the firefly models over population, density and movement")
+    parser.add_argument('--models', nargs='+', choices=models, default=list(models))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 400, 800])
+    parser.add_argument('--distances', type=int, nargs='+', default=[50, 150])
+    parser.add_argument('--movement', choices=['off', 'on', 'both'], default='both')
+    parser.add_argument('--engines', nargs='+', choices=['objects', 'vectorized'], default=['objects', 'vectorized'])
+    parser.add_argument('--until', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help="earlier result file to compare the ticks per second with")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--case', default=None, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit(0)
+
+    args.movement = {'off': [False], 'on': [True], 'both': [False, True]}[args.movement]
+    started = strftime("%Y-%m-%d %H:%M:%S")
+    results = []
+    for case in benchmark_cases(args):
+        try:
+            result = measure(case)
+        except subprocess.CalledProcessError:
+            print("{0} failed".format(case))
+            continue
+        results.append(result)
+        print("{0:<12} n={1:<5} d={2:<4} move={3:<5} {4:<10} {5:10.1f} ticks/s  sync={6}  rss={7}".format(
+            result['model'], result['n'], result['neighbor_distance'], str(result['movement']), result['engine'],
+            result['ticks_per_second'] or 0, result['synchronized_at'], result['peak_rss']))
+
+    output = args.output
+    if output is None:
+        output = os.path.join(root, "benchmarks", "results", "scaling__" + strftime("%d%m%Y_%H%M%S") + ".json")
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'started': started,
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print("Results in {0}".format(output))
+
+    if args.compare is not None and compare(results, args.compare, args.tolerance) > 0:
+        sys.exit(1)
@@ -0,0 +1,73 @@
+# Measures how long a fresh process takes to import and run a small headless simulation,
+# and whether pygame got loaded on the way
+#
+# Every measurement is the median over --repeat new interpreters, run from the repository
+# root, e.g.: python benchmarks/startup.py --repeat 10
+
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each child process imports and runs; it prints a JSON dictionary of timings
+cases = {
+    'pygame': (
+        "import pygame",
+        "pass"),
+    'lib.firefly': (
+        "from fireflies_linear import LinearFirefliesSimulation",
+        "sim = LinearFirefliesSimulation(n_fireflies=100)\n"
+        "sim.start_simulation(until=100, vectorized=True, log=None, verbose=False)"),
+    'SimPy headless': (
+        "from fireflies_des import FirefliesSimulation",
+        "sim = FirefliesSimulation(100, headless=True)\n"
+        "sim.start_simulation(until=100)"),
+}
+
+child = """
+import sys
+from time import time
+sys.path[:0] = [{root!r}, {simpy!r}]
+started = time()
+{imports}
+imported = time()
+{run}
+finished = time()
+import json
+print(json.dumps({{'import': imported - started, 'run': finished - imported,
+                   'pygame_loaded': 'pygame' in sys.modules}}))
+"""
+
+
+# Run a case in a new interpreter and return its timings
+def measure(name):
+    imports, run = cases[name]
+    code = child.format(root=root, simpy=os.path.join(root, 'SimPy'), imports=imports, run=run)
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the startup time of headless simulations")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('cases', nargs='*', default=sorted(cases))
+    args = parser.parse_args()
+
+    for name in args.cases:
+        try:
+            results = [measure(name) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print("{0:<16} failed".format(name))
+            continue
+        print("{0:<16} import {1:8.1f} ms   run {2:8.1f} ms   pygame loaded: {3}".format(
+            name, 1000 * median([r['import'] for r in results]), 1000 * median([r['run'] for r in results]),
+            results[0]['pygame_loaded']))
@@ -6,6 +6,8 @@ white = (255, 255, 255)
 
 
 class NonAdversarialFirefly(Firefly):
+    __slots__ = ()
+
     def nudge_clock(self, nudge):
         if self.clock >= (self.period / 2):
             self.clock += nudge
@@ -14,6 +16,9 @@ class NonAdversarialFirefly(Firefly):
 
 
 class AdversarialFirefly(Firefly):
+    __slots__ = ()
+    nudge_rule = 'adversarial'
+
     def nudge_clock(self, nudge):
         if self.clock >= (self.period / 2):
             self.clock -= nudge
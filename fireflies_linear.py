@@ -6,6 +6,9 @@ white = (255, 255, 255)
 
 
 class LinearFirefly(Firefly):
+    __slots__ = ()
+    nudge_rule = 'linear'
+
     def nudge_clock(self, nudge):
         self.clock += nudge
 
@@ -0,0 +1,35 @@
+import csv
+from argparse import ArgumentParser
+from lib.analysis import analyze_logs, find_logs
+
+
+if __name__ == "__main__":
+    # Summarize the logs of many runs, grouped by the parameters in their headers
+    parser = ArgumentParser(description="Aggregate time to sync and phase metric curves over simulation logs")
+    parser.add_argument('paths', nargs='*', help="logs to analyze (default: every log in --directory)")
+    parser.add_argument('--directory', default="logs")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--cache', default="logs/cache", help="directory parsed logs are kept in ('' for none)")
+    parser.add_argument('--step', type=int, default=100, help="iterations between points of the phase curves")
+    parser.add_argument('--curves', default=None, help="CSV file to write the mean phase metric curves to")
+    args = parser.parse_args()
+
+    paths = args.paths or find_logs(args.directory)
+    groups, errors = analyze_logs(paths, processes=args.processes, cache_dir=args.cache or None, step=args.step)
+    for path in sorted(errors):
+        print("Skipped {0}: {1}".format(path, errors[path]))
+
+    for group in groups:
+        params = ", ".join("{0}:{1}".format(name, value) for name, value in sorted(group['params'].items()))
+        print("{0}\n  runs:{1} synchronized:{2} time to sync mean:{3} median:{4}".format(
+            params, group['runs'], group['synchronized'], group['time_to_sync_mean'], group['time_to_sync_median']))
+
+    if args.curves is not None:
+        with open(args.curves, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['params', 'iteration', 'phase_mean', 'phase_std'])
+            for group in groups:
+                params = ";".join("{0}={1}".format(name, value) for name, value in sorted(group['params'].items()))
+                for row in zip(group['iterations'].tolist(), group['phase_mean'].tolist(),
+                               group['phase_std'].tolist()):
+                    writer.writerow([params] + list(row))
@@ -6,6 +6,10 @@ white = (255, 255, 255)
 
 
 class StrogatzianFirefly(Firefly):
+    __slots__ = ()
+    update_rule = 'strogatzian'
+    nudge_rule = 'linear'
+
     def nudge_clock(self, nudge):
         # delta = self.period - self.clock
         # self.clock += (0.01 * delta * nudge)
@@ -16,6 +20,16 @@ class StrogatzianFirefly(Firefly):
         self.clock += (0.1 * delta)
 
 
+# Firefly whose nudge shrinks as its clock gets closer to the period (a phase response curve)
+class PhaseResponseFirefly(Firefly):
+    __slots__ = ()
+    nudge_rule = 'phase_response'
+
+    def nudge_clock(self, nudge):
+        delta = self.period - self.clock
+        self.clock += (0.01 * delta * nudge)
+
+
 class StrogatzianFirefliesSimulation(FirefliesSimulation):
     def __init__(self, n_fireflies=100, period=50, nudge=15, neighbor_distance=50, movement=False):
         FirefliesSimulation.__init__(self, n_fireflies=n_fireflies,
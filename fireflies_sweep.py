@@ -0,0 +1,43 @@
+from argparse import ArgumentParser
+from fireflies_linear import LinearFirefliesSimulation
+from fireflies_strogatzian import StrogatzianFirefliesSimulation
+from fireflies_adversarial import AdversarialFirefliesSimulation
+from lib.sweep import run_sweep
+
+variants = {
+    'linear': LinearFirefliesSimulation,
+    'strogatzian': StrogatzianFirefliesSimulation,
+    'adversarial': AdversarialFirefliesSimulation,
+}
+
+
+if __name__ == "__main__":
+    # Every parameter takes a list of values, the sweep runs all their combinations
+    parser = ArgumentParser(description="Run a parameter sweep of a fireflies simulation")
+    parser.add_argument('variant', choices=sorted(variants))
+    parser.add_argument('--results', default="logs/sweep.csv")
+    parser.add_argument('--until', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-fireflies', type=int, nargs='+', default=[100])
+    parser.add_argument('--n-ad-fireflies', type=int, nargs='+', default=[5])
+    parser.add_argument('--period', type=int, nargs='+', default=[50])
+    parser.add_argument('--nudge', type=int, nargs='+', default=[15])
+    parser.add_argument('--neighbor-distance', type=int, nargs='+', default=[50])
+    parser.add_argument('--movement', action='store_true')
+    parser.add_argument('--warm-start', default=None, help="checkpoint every cell starts from")
+    args = parser.parse_args()
+
+    grid = {
+        'n_fireflies': args.n_fireflies,
+        'period': args.period,
+        'nudge': args.nudge,
+        'neighbor_distance': args.neighbor_distance,
+        'movement': [args.movement],
+    }
+    if args.variant == 'adversarial':
+        grid['n_ad_fireflies'] = args.n_ad_fireflies
+
+    ran = run_sweep(variants[args.variant], grid, args.results,
+                    until=args.until, processes=args.processes, seed=args.seed, warm_start=args.warm_start)
+    print("{0} configurations run, results in {1}".format(ran, args.results))
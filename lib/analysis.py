@@ -0,0 +1,222 @@
+# File which includes the loader and the analyzer of simulation logs
+#
+# A CSV log is read in bulk: the parameter header is parsed into a dictionary and the
+# body is converted to arrays by numpy in one go. Binary logs are memory-mapped. With a
+# cache directory, every CSV log parsed once is kept there in the binary format (and
+# memory-mapped from then on) until the log changes.
+#
+# analyze_logs summarizes many runs on a pool of worker processes and groups them by
+# their parameters: how many synchronized and how long it took, and the mean and std of
+# their phase metric curves, sampled every `step` iterations. A log which can't be read
+# is reported with its error and left out, without stopping the analysis of the others.
+#
+# Logs written before lib.runlog have the header iteration,mean,std,num over rows of the
+# same five values (the last one being the phase metric), and are read the same way.
+
+import os
+import shutil
+import numpy as np
+from hashlib import md5
+from multiprocessing import Pool, cpu_count
+from lib.runlog import columns, read_binary_log, write_binary_log
+
+integer_columns = ('iteration', 'num')
+
+# Header of the logs written before the phase metric column was named
+legacy_header = list(columns[:4])
+
+
+# Parameters of a run from the free-text header of its log, e.g.
+# "total fireflies:100, neighbor distance:50, nudge:15" -> {'total_fireflies': 100, ...}
+def parse_params(param_string):
+    params = {}
+    for field in param_string.strip().split(","):
+        if ":" not in field:
+            continue
+        name, value = field.split(":", 1)
+        params[name.strip().replace(" ", "_")] = parse_value(value.strip())
+    return params
+
+
+def parse_value(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+# Read a CSV log: the parameter line and a dictionary of columns
+def read_csv_log(path):
+    with open(path) as f:
+        param_string = f.readline()
+        f.readline()
+        header = f.readline().strip().split(",")
+        body = f.read()
+
+    if header != list(columns) and header != legacy_header:
+        raise ValueError("{0} is not a run log".format(path))
+    rows = body.count("\n") + (1 if body and not body.endswith("\n") else 0)
+    values = np.fromstring(body.replace("\n", ","), sep=",") if rows else np.zeros(0)
+    if len(values) != rows * len(columns):
+        raise ValueError("{0} has malformed rows".format(path))
+
+    values = values.reshape(rows, len(columns))
+    data = {}
+    for k, column in enumerate(columns):
+        data[column] = values[:, k].astype(np.int64) if column in integer_columns else values[:, k].copy()
+    return param_string, data
+
+
+# Private method to find the cache entry of a CSV log, valid while the log keeps its size and time
+def cache_entry(path, cache_dir):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = "{0} {1} {2!r}".format(path, stat.st_size, stat.st_mtime)
+    return os.path.join(cache_dir, md5(path.encode('utf-8')).hexdigest()), stamp
+
+
+# Load a log (a CSV file or a binary log directory) as (parameters, columns)
+# With a cache directory, CSV logs are parsed once and memory-mapped afterwards
+def load_log(path, cache_dir=None):
+    if os.path.isdir(path):
+        param_string, data = read_binary_log(path)
+        return parse_params(param_string), data
+    if cache_dir is None:
+        param_string, data = read_csv_log(path)
+        return parse_params(param_string), data
+
+    entry, stamp = cache_entry(path, cache_dir)
+    stamp_path = os.path.join(entry, "source.txt")
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read() == stamp:
+                param_string, data = read_binary_log(entry)
+                return parse_params(param_string), data
+
+    param_string, data = read_csv_log(path)
+
+    # Written next to the entry and renamed, so a reader never sees half an entry
+    partial = entry + ".tmp{0}".format(os.getpid())
+    write_binary_log(partial, param_string, data)
+    with open(os.path.join(partial, "source.txt"), 'w') as f:
+        f.write(stamp)
+    if os.path.isdir(entry):
+        shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.rename(partial, entry)
+    except OSError:
+        shutil.rmtree(partial, ignore_errors=True)
+    return parse_params(param_string), data
+
+
+# The logs in a directory (log__<timestamp>.csv files and binary log__<timestamp> directories)
+def find_logs(directory="logs"):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("log__"))
+
+
+# First iteration in which every firefly flashed and the phase metric was 0, like the
+# simulation stops at (None if the run didn't synchronize, or its log didn't keep that row)
+def synchronized_at(params, data):
+    n = params.get('total_fireflies')
+    if n is None:
+        return None
+    synchronized = (data['num'] == n) & (data['phase_metric'] == 0)
+    found = np.flatnonzero(synchronized)
+    return data['iteration'][found[0]].item() if len(found) > 0 else None
+
+
+# Summary of one run: its parameters, length, synchronization and phase metric curve
+# (the metric at every multiple of step, as of the last logged row at or before it)
+def summarize_log(path, cache_dir=None, step=100):
+    params, data = load_log(path, cache_dir)
+    iterations = np.asarray(data['iteration'])
+    metrics = np.asarray(data['phase_metric'])
+    summary = {
+        'path': path,
+        'params': params,
+        'rows': len(iterations),
+        'last_iteration': iterations[-1].item() if len(iterations) > 0 else 0,
+        'synchronized_at': synchronized_at(params, data),
+        'final_phase_metric': metrics[-1].item() if len(metrics) > 0 else None,
+    }
+
+    grid = np.arange(step, summary['last_iteration'] + 1, step)
+    at = np.searchsorted(iterations, grid, side='right') - 1
+    summary['curve'] = np.where(at >= 0, metrics[np.maximum(at, 0)], np.nan)
+    return summary
+
+
+# Private method to summarize a log in a worker process
+# A log which can't be read gives {'path': path, 'error': message} instead
+def summarize_task(task):
+    path, cache_dir, step = task
+    try:
+        return summarize_log(path, cache_dir, step)
+    except (ValueError, IOError, OSError) as error:
+        return {'path': path, 'error': "{0}: {1}".format(error.__class__.__name__, error)}
+
+
+# Key of the group of runs with the same parameters
+def params_key(params):
+    return ",".join("{0}={1}".format(name, params[name]) for name in sorted(params))
+
+
+# Statistics of the runs with the same parameters
+# Runs which synchronized keep their final metric (0) for the rest of the longest run
+def aggregate(summaries, step):
+    length = max(len(summary['curve']) for summary in summaries)
+    curves = np.full((len(summaries), length), np.nan)
+    for k, summary in enumerate(summaries):
+        curve = summary['curve']
+        curves[k, :len(curve)] = curve
+        if summary['synchronized_at'] is not None and len(curve) < length:
+            curves[k, len(curve):] = 0
+
+    times = [summary['synchronized_at'] for summary in summaries if summary['synchronized_at'] is not None]
+    counted = np.maximum(np.sum(~np.isnan(curves), axis=0), 1)
+    phase_mean = np.nansum(curves, axis=0) / counted
+    phase_std = np.sqrt(np.nansum((curves - phase_mean) ** 2, axis=0) / counted)
+    return {
+        'params': summaries[0]['params'],
+        'runs': len(summaries),
+        'synchronized': len(times),
+        'time_to_sync_mean': float(np.mean(times)) if times else None,
+        'time_to_sync_median': float(np.median(times)) if times else None,
+        'iterations': np.arange(1, length + 1) * step,
+        'phase_mean': phase_mean,
+        'phase_std': phase_std,
+    }
+
+
+# Summarize the given logs on a pool of processes and aggregate them by parameters
+# This method returns the groups, sorted by their parameters, and the {path: error}
+# of the logs which couldn't be read
+def analyze_logs(paths, processes=None, cache_dir=None, step=100):
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tasks = [(path, cache_dir, step) for path in paths]
+    if not tasks:
+        return [], {}
+
+    # A few chunks per process, so thousands of small logs don't cost a round trip each
+    chunksize = max(1, len(tasks) // (4 * (processes or cpu_count())))
+    pool = Pool(processes)
+    try:
+        summaries = pool.map(summarize_task, tasks, chunksize=chunksize)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    groups = {}
+    errors = {}
+    for summary in summaries:
+        if 'error' in summary:
+            errors[summary['path']] = summary['error']
+        else:
+            groups.setdefault(params_key(summary['params']), []).append(summary)
+    return [aggregate(groups[key], step) for key in sorted(groups)], errors
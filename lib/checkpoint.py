@@ -0,0 +1,136 @@
+# File which includes the checkpoints of a simulation's state
+#
+# A checkpoint is an uncompressed .npz archive of flat arrays: the positions, clocks,
+# periods and last nudged times of the fireflies, the class of every firefly (as a code
+# into the list of class paths), the state of the random module, the simulation time and
+# the parameters of the simulation. The arrays are written as they are, without
+# compression, into a temporary file which then replaces the checkpoint, so a crash
+# while saving never leaves a broken checkpoint behind.
+#
+# Restoring a checkpoint into a simulation built with the same parameters continues
+# the run exactly as if it had not been interrupted. A warm start only takes the state
+# of the fireflies, and keeps the parameters and the random state of the simulation.
+
+import os
+import random
+import numpy as np
+from importlib import import_module
+
+parameters = ('nudge_duration', 'neighbor_distance', 'movement', 'canvas_length', 'canvas_width')
+
+
+# Path of the class of an object, which import_class turns back into the class
+def class_path(obj):
+    cls = obj.__class__
+    return "{0}.{1}".format(cls.__module__, cls.__name__)
+
+
+def import_class(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+# The state of a simulation as a dictionary of arrays
+# The state is taken from the array engine while it is running, otherwise from the firefly objects
+def snapshot(sim):
+    fireflies = sim.fireflies
+    engine = sim.engine
+    if engine is not None:
+        state = {
+            'xs': engine.xs,
+            'ys': engine.ys,
+            'clocks': engine.clocks,
+            'periods': engine.periods,
+            'last_nudged_at': engine.last_nudged_at,
+        }
+    else:
+        state = {
+            'xs': np.array([firefly.x for firefly in fireflies], dtype=np.int64),
+            'ys': np.array([firefly.y for firefly in fireflies], dtype=np.int64),
+            'clocks': np.array([firefly.clock for firefly in fireflies]),
+            'periods': np.array([firefly.period for firefly in fireflies]),
+            'last_nudged_at': np.array([firefly.last_nudged_at for firefly in fireflies], dtype=np.int64),
+        }
+
+    paths = [class_path(firefly) for firefly in fireflies]
+    names = sorted(set(paths))
+    lookup = dict((name, code) for code, name in enumerate(names))
+    state['class_names'] = np.array(names)
+    state['class_codes'] = np.array([lookup[path] for path in paths], dtype=np.int16)
+
+    version, internal, gauss_next = random.getstate()
+    state['random_version'] = np.array(version)
+    state['random_state'] = np.array(internal, dtype=np.uint64)
+    state['random_gauss'] = np.array([] if gauss_next is None else [gauss_next], dtype=np.float64)
+
+    state['time'] = np.array(sim.time, dtype=np.int64)
+    state['phase_metric'] = np.array(np.nan if sim.phase_metric is None else sim.phase_metric)
+    for name in parameters:
+        state[name] = np.array(getattr(sim, name))
+    return state
+
+
+# Save the state of a simulation to path (a .npz file)
+def save_checkpoint(sim, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    temporary = path + ".tmp"
+    with open(temporary, 'wb') as f:
+        np.savez(f, **snapshot(sim))
+    os.rename(temporary, path)
+
+
+# Read a checkpoint back as a dictionary of arrays
+def load_checkpoint(path):
+    with np.load(path) as archive:
+        return dict((name, archive[name]) for name in archive.files)
+
+
+# Put the state saved in path into a simulation with as many fireflies
+# With warm_start=True only the fireflies are restored, the parameters and the
+# random state of the simulation are kept
+def restore_checkpoint(sim, path, warm_start=False):
+    state = load_checkpoint(path)
+    n = len(state['xs'])
+    if n != len(sim.fireflies):
+        raise ValueError("The checkpoint has {0} fireflies, the simulation has {1}".format(n, len(sim.fireflies)))
+
+    classes = [import_class(name) for name in state['class_names'].tolist()]
+    codes = state['class_codes'].tolist()
+    xs = state['xs'].tolist()
+    ys = state['ys'].tolist()
+    clocks = state['clocks'].tolist()
+    periods = state['periods'].tolist()
+    last_nudged_at = state['last_nudged_at'].tolist()
+
+    # Fireflies of another class are replaced before the random state is restored,
+    # as building them draws their initial clocks
+    for i in range(n):
+        cls = classes[codes[i]]
+        if sim.fireflies[i].__class__ is not cls:
+            sim.fireflies[i] = cls(x=xs[i], y=ys[i], period=periods[i])
+
+    for i, firefly in enumerate(sim.fireflies):
+        firefly.x = xs[i]
+        firefly.y = ys[i]
+        firefly.clock = clocks[i]
+        firefly.period = periods[i]
+        firefly.last_nudged_at = last_nudged_at[i]
+
+    sim.time = state['time'].item()
+    phase_metric = state['phase_metric'].item()
+    sim.phase_metric = None if phase_metric != phase_metric else phase_metric
+    sim.synchronized_at = None
+
+    if not warm_start:
+        for name in parameters:
+            setattr(sim, name, state[name].item())
+        gauss = state['random_gauss'].tolist()
+        random.setstate((state['random_version'].item(), tuple(state['random_state'].tolist()),
+                         gauss[0] if gauss else None))
+
+    # The neighbors follow from the positions
+    sim.grid = None
+    sim.update_firefly_neighbors()
@@ -0,0 +1,286 @@
+# File which includes the array-backed engine for the fireflies simulation
+#
+# The engine keeps the state of the whole population (positions, clocks, periods,
+# last nudged times) in numpy arrays and advances it with vectorized operations.
+# It mirrors the private step methods of FirefliesSimulation, so the simulation
+# loop can drive either the firefly objects or the engine.
+
+import numpy as np
+from math import fsum
+from lib.movement import random_steps, resolve_moves, step_positions
+from lib.neighbors import CSRAdjacency, set_neighbors, update_grid
+from lib.rules import apply_rules, keeps_integral, nudge_rules, population_rules, update_rules
+
+
+# Mean and std of integral clocks from their sum and their sum of squares
+# The variance is computed exactly from the integral sums, so the result only depends on the
+# clocks: the firefly objects, the engines and the running statistics give the same bits
+def integer_mean_std(clock_sum, clock_sumsq, n):
+    curr_mean = np.float64(clock_sum) / n
+    curr_std = np.sqrt(np.float64(n * clock_sumsq - clock_sum ** 2) / (n * n))
+    return curr_mean, curr_std
+
+
+# Phase distance summed over edges: integral distances are summed exactly and float ones
+# with fsum, which rounds the exact sum once, so the result doesn't depend on the order
+# of the edges and every model and engine gives the same bits
+def phase_distance(distances):
+    if distances.dtype.kind == 'f':
+        return fsum(distances.tolist())
+    return distances.sum().item()
+
+
+class ArrayEngine:
+    def __init__(self, simulation):
+        self.sim = simulation
+        self.n = len(simulation.fireflies)
+
+        self.xs = None
+        self.ys = None
+        self.periods = None
+        self.clocks = None
+        self.last_nudged_at = None
+
+        # Rules used by the population (see lib.rules) and the rule code of every firefly;
+        # the fireflies of every update rule are fixed, so they are only looked up once
+        self.update_rules = []
+        self.update_codes = None
+        self.update_members = []
+        self.nudge_rules = []
+        self.nudge_codes = None
+
+        # Spatial index of the positions, kept between neighbor updates
+        self.grid = None
+
+        # Neighbors in compressed sparse-row form
+        self.adjacency = None
+
+        # Running statistics of integral clocks which only get incremented: the sums are
+        # shifted by the increment every tick and corrected for the fireflies which flashed
+        # or were nudged. shadow + offset is the clock of every firefly as of the last stats,
+        # apart from the changed ones. A full recompute runs every full_stats_every ticks,
+        # or once more than full_stats_every steps changed clocks since the last stats.
+        self.incremental = False
+        self.full_stats_every = 1000
+        self.stats_valid = False
+        self.stats_age = 0
+        self.clock_sum = 0
+        self.clock_sumsq = 0
+        self.phase_total = 0
+        self.shadow = None
+        self.offset = 0
+        self.changed = []
+
+        self.load()
+
+    # Copy the state of the firefly objects into the arrays
+    def load(self):
+        fireflies = self.sim.fireflies
+        self.xs = np.array([firefly.x for firefly in fireflies], dtype=np.int64)
+        self.ys = np.array([firefly.y for firefly in fireflies], dtype=np.int64)
+        self.periods = np.array([firefly.period for firefly in fireflies])
+        self.last_nudged_at = np.array([firefly.last_nudged_at for firefly in fireflies], dtype=np.int64)
+
+        self.update_rules, self.update_codes = population_rules(update_rules,
+                                                                [firefly.update_rule for firefly in fireflies])
+        self.nudge_rules, self.nudge_codes = population_rules(nudge_rules,
+                                                              [firefly.nudge_rule for firefly in fireflies])
+        self.update_members = [np.flatnonzero(self.update_codes == rule.code) for rule in self.update_rules]
+
+        clocks = np.array([firefly.clock for firefly in fireflies])
+        if isinstance(self.sim.nudge_duration, float) or not keeps_integral(self.update_rules + self.nudge_rules):
+            clocks = clocks.astype(np.float64)
+        self.clocks = clocks
+        self.incremental = ([rule.name for rule in self.update_rules] == ['increment'] and
+                            clocks.dtype.kind == 'i')
+
+        self.update_firefly_neighbors()
+
+    # Copy the state of the arrays back into the firefly objects
+    def store(self):
+        fireflies = self.sim.fireflies
+        xs = self.xs.tolist()
+        ys = self.ys.tolist()
+        clocks = self.clocks.tolist()
+        last_nudged_at = self.last_nudged_at.tolist()
+        for i, firefly in enumerate(fireflies):
+            firefly.x = xs[i]
+            firefly.y = ys[i]
+            firefly.clock = clocks[i]
+            firefly.last_nudged_at = last_nudged_at[i]
+        set_neighbors(fireflies, self.adjacency)
+
+    # Release what the engine holds (nothing, for this engine)
+    def close(self):
+        pass
+
+    # Private method to update firefly clocks
+    def update_firefly_clocks(self):
+        if self.incremental and self.stats_valid:
+            self.clock_sumsq += 2 * self.clock_sum + self.n
+            self.clock_sum += self.n
+            self.offset += 1
+
+        if len(self.update_rules) == 1:
+            self.clocks = self.update_rules[0].function(self.clocks, self.periods)
+            return
+
+        for rule, members in zip(self.update_rules, self.update_members):
+            self.clocks[members] = rule.function(self.clocks[members], self.periods[members])
+
+    # Private method to make the fireflies flash
+    # This method returns the indices of fireflies which flashed in this simulation time step
+    def flash_fireflies(self):
+        flashed = np.flatnonzero(self.clocks >= self.periods)
+        self.clocks[flashed] = 0
+        self.mark_changed(flashed)
+        return flashed
+
+    # Private method to nudge the clocks
+    # Every neighbor of a flashed firefly is nudged at most once per time step,
+    # so the order in which the flashed fireflies are visited doesn't matter:
+    # the neighbors are gathered, deduplicated and nudged in one go
+    # This method returns the number of fireflies which were nudged
+    def do_local_communication(self, flashed):
+        if len(flashed) == 0:
+            return 0
+
+        time = self.sim.time
+        targets = np.unique(self.adjacency.gather(flashed))
+        nudged = targets[self.last_nudged_at[targets] != time]
+
+        apply_rules(self.nudge_rules, self.nudge_codes, nudged, self.clocks, self.periods, self.sim.nudge_duration)
+
+        clocks = self.clocks[nudged]
+        self.clocks[nudged] = np.where(clocks < 0, 0, clocks)
+        self.last_nudged_at[nudged] = time
+        self.mark_changed(nudged)
+        return len(nudged)
+
+    # Private method to note the fireflies whose clocks changed since the last stats
+    # When the stats aren't asked for a long time, the running statistics are dropped
+    # instead, and recomputed from scratch when they are
+    def mark_changed(self, indices):
+        if len(self.changed) >= self.full_stats_every:
+            self.changed = []
+            self.stats_valid = False
+        if self.stats_valid:
+            self.changed.append(indices)
+
+    # Private method to update firefly positions
+    # The steps of the whole population are drawn and clamped in one batch,
+    # the collisions are resolved in the same order as the object model
+    # This method returns the number of fireflies which moved
+    def update_firefly_positions(self):
+        x_factor = int(self.sim.canvas_length / 200)
+        y_factor = int(self.sim.canvas_width / 200)
+        x_ops, y_ops = random_steps(self.n)
+        new_xs, new_ys = step_positions(self.xs, self.ys, x_ops, y_ops, x_factor, y_factor,
+                                        self.sim.canvas_length, self.sim.canvas_width)
+        moved = resolve_moves(self.xs, self.ys, new_xs, new_ys, self.sim.canvas_width)
+        self.xs[moved] = new_xs[moved]
+        self.ys[moved] = new_ys[moved]
+        return int(moved.sum())
+
+    # Private method to update firefly neighbors
+    def update_firefly_neighbors(self):
+        self.grid = update_grid(self.grid, self.xs, self.ys, self.sim.neighbor_distance)
+        firsts, seconds = self.grid.pairs(self.sim.neighbor_distance)
+        self.adjacency = CSRAdjacency.from_pairs(self.n, firsts, seconds)
+        self.stats_valid = False
+
+    # Number of (directed) neighbor edges
+    def count_edges(self):
+        return len(self.adjacency.indices)
+
+    def move_fireflies(self):
+        self.update_firefly_positions()
+        self.update_firefly_neighbors()
+
+    # Get simulation stats
+    def get_sim_stats(self):
+        if not self.incremental or not self.stats_valid or self.stats_age >= self.full_stats_every:
+            return self.get_full_sim_stats()
+
+        changed = np.unique(np.concatenate(self.changed)) if self.changed else []
+        self.changed = []
+        if len(changed) > 0:
+            current = self.clocks[changed]
+            baseline = self.shadow[changed] + self.offset
+            self.clock_sum += int(current.sum() - baseline.sum())
+            self.clock_sumsq += int((current ** 2).sum() - (baseline ** 2).sum())
+
+            # Only the edges touching a changed firefly have a different phase distance.
+            # Summing the edges leaving the changed fireflies counts the edges between
+            # two changed fireflies once per direction, and the others only once.
+            i, j = self.adjacency.gather_edges(changed)
+            inside = np.isin(j, changed)
+            before = np.abs(self.shadow[i] - self.shadow[j])
+            after = np.abs(self.clocks[i] - self.clocks[j])
+            self.phase_total += int(2 * (after.sum() - before.sum()) - (after[inside].sum() - before[inside].sum()))
+
+            self.shadow[changed] = current - self.offset
+
+        self.stats_age += 1
+        curr_mean, curr_std = self.get_running_mean_std()
+        return curr_mean, curr_std, self.phase_total
+
+    # Private method to get the mean and std of the clocks from the running sums
+    def get_running_mean_std(self):
+        return integer_mean_std(self.clock_sum, self.clock_sumsq, self.n)
+
+    # Private method to compute the stats from scratch and reset the running statistics
+    def get_full_sim_stats(self):
+        # Phase distance summed over every (directed) edge
+        i, j = self.adjacency.edges()
+        total_phase_distance = phase_distance(np.abs(self.clocks[i] - self.clocks[j]))
+
+        self.changed = []
+        if self.incremental and self.n > 0:
+            self.clock_sum = int(self.clocks.sum())
+            self.clock_sumsq = int((self.clocks ** 2).sum())
+            self.phase_total = total_phase_distance
+            self.shadow = self.clocks.copy()
+            self.offset = 0
+            self.stats_age = 0
+            self.stats_valid = True
+            curr_mean, curr_std = self.get_running_mean_std()
+            return curr_mean, curr_std, total_phase_distance
+
+        curr_mean, curr_std = self.get_mean_std()
+        return curr_mean, curr_std, total_phase_distance
+
+    # Private method to get the mean and std of the clocks, exactly like the firefly objects do
+    def get_mean_std(self):
+        if self.clocks.dtype.kind == 'i' and self.n > 0:
+            return integer_mean_std(int(self.clocks.sum()), int((self.clocks ** 2).sum()), self.n)
+        return np.mean(self.clocks), np.std(self.clocks)
+
+    # Number of upcoming ticks in which no firefly flashes, and so nobody gets nudged
+    # It is only known when the clocks are integral and get incremented every tick
+    def idle_ticks(self):
+        if not self.incremental or self.n == 0:
+            return 0
+        return max(0, int((self.periods - self.clocks).min()) - 1)
+
+    # Apply the given number of idle ticks at once
+    # This method returns the mean, std and phase metric after every skipped tick,
+    # or only after the ones selected by the boolean array wanted
+    def skip_ticks(self, ticks, wanted=None):
+        # The running sums only take in the flashes and nudges when the stats are asked for
+        # (and the partitioned engine only keeps them up to date there), so bring them up to now
+        _, curr_std, _ = self.get_sim_stats()
+        sums = self.clock_sum + self.n * np.arange(1, ticks + 1)
+        means = sums.astype(np.float64) / self.n
+        stds = np.full(ticks, curr_std)
+        phase_metrics = np.full(ticks, self.phase_total)
+
+        # Every clock moved up by the same amount: the spread and the phase distances don't change
+        self.clocks += ticks
+        self.clock_sumsq += 2 * ticks * self.clock_sum + self.n * ticks ** 2
+        self.clock_sum += self.n * ticks
+        self.offset += ticks
+        self.stats_age += ticks
+        if wanted is not None:
+            return means[wanted], stds[wanted], phase_metrics[wanted]
+        return means, stds, phase_metrics
@@ -0,0 +1,176 @@
+# File which includes the ensemble engine, which runs replicates of a simulation together
+#
+# The replicates share their parameters but not their placements or initial clocks.
+# Their state is kept in (replicates x fireflies) arrays and their neighbor graphs in
+# one block-diagonal adjacency, so every step is a handful of vectorized operations
+# over all the replicates. A replicate is retired as soon as it synchronizes.
+
+import numpy as np
+from lib.engine import phase_distance
+from lib.movement import random_steps, resolve_moves, step_positions
+from lib.neighbors import CSRAdjacency, set_neighbors, update_grid
+from lib.rules import apply_rules, keeps_integral, nudge_rules, population_rules, update_rules
+
+
+class EnsembleEngine:
+    def __init__(self, simulations):
+        first = simulations[0]
+        for sim in simulations:
+            if (len(sim.fireflies) != len(first.fireflies) or sim.time != first.time or
+                    sim.nudge_duration != first.nudge_duration or
+                    sim.neighbor_distance != first.neighbor_distance or sim.movement != first.movement or
+                    (sim.canvas_length, sim.canvas_width) != (first.canvas_length, first.canvas_width)):
+                raise ValueError("The replicates of an ensemble must share their parameters")
+
+        self.simulations = simulations
+        self.n = len(first.fireflies)
+        self.time = first.time
+        self.nudge_duration = first.nudge_duration
+        self.neighbor_distance = first.neighbor_distance
+        self.movement = first.movement
+        self.canvas_length = first.canvas_length
+        self.canvas_width = first.canvas_width
+
+        # Replicate held in every row of the state arrays
+        self.replicates = np.arange(len(simulations))
+
+        fireflies = [sim.fireflies for sim in simulations]
+        self.xs = np.array([[firefly.x for firefly in row] for row in fireflies], dtype=np.int64)
+        self.ys = np.array([[firefly.y for firefly in row] for row in fireflies], dtype=np.int64)
+        self.periods = np.array([[firefly.period for firefly in row] for row in fireflies])
+        self.last_nudged_at = np.array([[firefly.last_nudged_at for firefly in row] for row in fireflies],
+                                       dtype=np.int64)
+
+        flat = [firefly for row in fireflies for firefly in row]
+        self.update_rules, update_codes = population_rules(update_rules, [firefly.update_rule for firefly in flat])
+        self.nudge_rules, nudge_codes = population_rules(nudge_rules, [firefly.nudge_rule for firefly in flat])
+        self.update_codes = update_codes.reshape(self.xs.shape)
+        self.nudge_codes = nudge_codes.reshape(self.xs.shape)
+
+        clocks = np.array([[firefly.clock for firefly in row] for row in fireflies])
+        if isinstance(self.nudge_duration, float) or not keeps_integral(self.update_rules + self.nudge_rules):
+            clocks = clocks.astype(np.float64)
+        self.clocks = clocks
+
+        # Neighbors of every replicate, and all of them as one block-diagonal adjacency
+        self.grids = [None] * len(simulations)
+        self.adjacencies = [None] * len(simulations)
+        self.adjacency = None
+        for row in range(len(simulations)):
+            self.update_replicate_neighbors(row)
+        self.stack_adjacencies()
+
+        # Stats of the active replicates after the last step
+        self.flash_counts = np.zeros(len(simulations), dtype=np.int64)
+        self.phase_metric = np.zeros(len(simulations))
+
+    # Private method to rebuild the neighbors of the replicate in a row
+    def update_replicate_neighbors(self, row):
+        self.grids[row] = update_grid(self.grids[row], self.xs[row], self.ys[row], self.neighbor_distance)
+        firsts, seconds = self.grids[row].pairs(self.neighbor_distance)
+        self.adjacencies[row] = CSRAdjacency.from_pairs(self.n, firsts, seconds)
+
+    # Private method to put the neighbors of all the replicates into one adjacency
+    def stack_adjacencies(self):
+        self.adjacency = CSRAdjacency.stack(self.adjacencies)
+
+    # Advance all the active replicates by one simulation step
+    def step(self):
+        clocks = self.clocks.reshape(-1)
+        periods = self.periods.reshape(-1)
+
+        # Update the clocks
+        everyone = np.arange(len(clocks))
+        apply_rules(self.update_rules, self.update_codes.reshape(-1), everyone, clocks, periods)
+
+        # Make the fireflies flash
+        flashed = np.flatnonzero(clocks >= periods)
+        clocks[flashed] = 0
+
+        # Do the local communication i.e. nudge the clocks, at most once per firefly
+        if len(flashed) > 0:
+            last_nudged_at = self.last_nudged_at.reshape(-1)
+            targets = np.unique(self.adjacency.gather(flashed))
+            nudged = targets[last_nudged_at[targets] != self.time]
+            apply_rules(self.nudge_rules, self.nudge_codes.reshape(-1), nudged, clocks, periods, self.nudge_duration)
+            clocks[nudged] = np.where(clocks[nudged] < 0, 0, clocks[nudged])
+            last_nudged_at[nudged] = self.time
+
+        if self.movement:
+            if self.time % 10 == 0:
+                self.move_fireflies()
+
+        # Increment the time
+        self.time += 1
+
+        # Per replicate: number of flashes and phase distance summed over its edges
+        self.flash_counts = np.bincount(flashed // self.n, minlength=len(self.replicates))
+        # (float distances are summed replicate by replicate, like a single simulation does)
+        i, j = self.adjacency.edges()
+        distances = np.abs(clocks[i] - clocks[j])
+        bounds = self.adjacency.indptr[np.arange(len(self.replicates) + 1) * self.n]
+        if distances.dtype.kind == 'f':
+            self.phase_metric = np.array([phase_distance(distances[start:stop])
+                                          for start, stop in zip(bounds[:-1], bounds[1:])])
+        else:
+            sums = np.concatenate(([0], np.cumsum(distances)))
+            self.phase_metric = sums[bounds[1:]] - sums[bounds[:-1]]
+
+    # Private method to move the fireflies of every replicate
+    def move_fireflies(self):
+        x_factor = int(self.canvas_length / 200)
+        y_factor = int(self.canvas_width / 200)
+        for row in range(len(self.replicates)):
+            x_ops, y_ops = random_steps(self.n)
+            new_xs, new_ys = step_positions(self.xs[row], self.ys[row], x_ops, y_ops, x_factor, y_factor,
+                                            self.canvas_length, self.canvas_width)
+            moved = resolve_moves(self.xs[row], self.ys[row], new_xs, new_ys, self.canvas_width)
+            self.xs[row, moved] = new_xs[moved]
+            self.ys[row, moved] = new_ys[moved]
+            self.update_replicate_neighbors(row)
+        self.stack_adjacencies()
+
+    # Copy the state of a row back into the firefly objects of its replicate
+    def store(self, row):
+        sim = self.simulations[self.replicates[row]]
+        sim.time = self.time
+        sim.phase_metric = self.phase_metric[row].item()
+        xs = self.xs[row].tolist()
+        ys = self.ys[row].tolist()
+        clocks = self.clocks[row].tolist()
+        last_nudged_at = self.last_nudged_at[row].tolist()
+        for i, firefly in enumerate(sim.fireflies):
+            firefly.x = xs[i]
+            firefly.y = ys[i]
+            firefly.clock = clocks[i]
+            firefly.last_nudged_at = last_nudged_at[i]
+        set_neighbors(sim.fireflies, self.adjacencies[row])
+
+    # Private method to drop the rows of the replicates which synchronized
+    def retire(self, rows):
+        for row in rows:
+            self.simulations[self.replicates[row]].synchronized_at = self.time
+            self.store(row)
+
+        keep = np.setdiff1d(np.arange(len(self.replicates)), rows)
+        self.replicates = self.replicates[keep]
+        for name in ('xs', 'ys', 'periods', 'clocks', 'last_nudged_at', 'update_codes', 'nudge_codes'):
+            setattr(self, name, np.ascontiguousarray(getattr(self, name)[keep]))
+        self.grids = [self.grids[row] for row in keep]
+        self.adjacencies = [self.adjacencies[row] for row in keep]
+        self.flash_counts = self.flash_counts[keep]
+        self.phase_metric = self.phase_metric[keep]
+        self.stack_adjacencies()
+
+    # Step the replicates until all of them synchronized, or until the given time
+    def run(self, until=10000000):
+        while self.time < until and len(self.replicates) > 0:
+            self.step()
+
+            # If fully synchronized
+            synchronized = np.flatnonzero((self.flash_counts == self.n) & (self.phase_metric == 0))
+            if len(synchronized) > 0:
+                self.retire(synchronized)
+
+        for row in range(len(self.replicates)):
+            self.store(row)
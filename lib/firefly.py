@@ -1,23 +1,48 @@
 # File which includes the base class for fireflies
 
-import pygame
-from math import sqrt
-from time import sleep, strftime
-from numpy import mean, std
+from math import fsum
+from numbers import Integral
+from time import sleep
+from numpy import arange, array, empty, int32, int64, mean, std, zeros
 from random import randint
+from lib.checkpoint import restore_checkpoint, save_checkpoint
+from lib.engine import ArrayEngine, integer_mean_std
+from lib.ensemble import EnsembleEngine
+from lib.movement import Occupancy, random_steps
+from lib.neighbors import CSRAdjacency, set_neighbors, update_grid
+from lib.partition import PartitionedEngine
+from lib.profiling import make_profiler
+from lib.render import FrameWriter, init_display, quit_display
+from lib.rules import nudge_rules, update_rules
+from lib.runlog import make_run_log
+from lib.stopping import make_stop_criteria
+from lib.streaming import TickStats
 
 black = (0, 0, 0)
 white = (255, 255, 255)
 
+# Neighbors of a firefly which has none
+no_neighbors = zeros(0, dtype=int32)
+
+
+# The attributes of a firefly are slots, so a population holds no per-firefly dict
+# (subclasses declare __slots__ = () to keep it that way)
+# The neighbors of a firefly are the int32 indices of the fireflies in the population
+# which are close enough, as a view into an array shared by the whole population
+class Firefly(object):
+    __slots__ = ('x', 'y', 'period', 'clock', 'last_nudged_at', 'neighbors')
+
+    # Names of the vectorized rules the array engine applies to this kind of firefly
+    update_rule = 'increment'
+    nudge_rule = 'symmetric'
 
-class Firefly:
     def __init__(self, x, y, period):
         self.x = x
         self.y = y
         self.period = period
         self.clock = randint(1, self.period)
         self.last_nudged_at = 0
-        self.neighbors = []
+        self.neighbors = no_neighbors
 
     def update_clock(self):
         # Increment the clock
@@ -51,6 +76,8 @@ class FirefliesSimulation:
         self.canvas_length = 800                # Default is 800
         self.canvas_width = 800                 # Default is 800
         self.space = None
+        self.renderer = None
+        self.profiler = None
 
         self.movement = movement
         self.time = 0
@@ -60,12 +87,23 @@ class FirefliesSimulation:
         self.fireflies = []
         self.neighbor_distance = neighbor_distance
 
+        # Spatial index of the firefly positions, kept between neighbor updates
+        self.grid = None
+
+        # Array-backed engine, only present while a vectorized simulation is running
+        self.engine = None
+
+        # Outcome of the last run: when it synchronized (None if it didn't) and its final phase metric
+        self.synchronized_at = None
+        self.phase_metric = None
+
+        # Stop criterion which ended the last run early, if any
+        self.stopped_by = None
+
     def visualization_init(self):
-        # Initialize pygame library
-        pygame.init()
-        self.space = pygame.display.set_mode((self.canvas_length, self.canvas_width))
-        pygame.display.set_caption('Fireflies')
-        self.space.fill(black)        # Set the background color as black
+        # Initialize pygame library (only loaded for visualized runs)
+        self.renderer = init_display(self.canvas_length, self.canvas_width)
+        self.space = self.renderer.surface
 
     # Private method to update firefly clocks
     def update_firefly_clocks(self):
@@ -86,18 +124,27 @@ class FirefliesSimulation:
                 flashed.append(firefly)
         return flashed
 
+    # Private method to get the positions of the flashed fireflies
+    # (indices into the engine's arrays when the array engine is running)
+    def get_flashed_positions(self, flashed):
+        if self.engine is not None:
+            return self.engine.xs[flashed], self.engine.ys[flashed]
+        return [firefly.x for firefly in flashed], [firefly.y for firefly in flashed]
+
     # Private method to make the flashed fireflies visualize
-    def visualize_flashed_fireflies(self, flashed):
-        for firefly in flashed:
-            # Spread the light (will be turned off outside this function)
-            firefly.light_up(self.space)
-        pygame.display.update()
+    def visualize_flashed_fireflies(self, xs, ys):
+        # Spread the light (will be turned off outside this function)
+        self.renderer.draw(xs, ys)
 
     # Private method to nudge the clocks
+    # This method returns the number of fireflies which were nudged
     def do_local_communication(self, flashed):
+        fireflies = self.fireflies
+        nudged = 0
         for firefly in flashed:
             # Nudge every neighbor that is not nudged at this time step
-            for neighbor in firefly.neighbors:
+            for j in firefly.neighbors.tolist():
+                neighbor = fireflies[j]
                 if neighbor.last_nudged_at != self.time:
                     neighbor.nudge_clock(self.nudge_duration)
 
@@ -105,19 +152,22 @@ class FirefliesSimulation:
                         neighbor.clock = 0
 
                     neighbor.set_last_nudged_at(self.time)
+                    nudged += 1
+        return nudged
 
     # Private method to update firefly positions
     # This will try to move the firefly to a new position,
     # but won't move it if there's one already there
+    # This method returns the number of fireflies which moved
     def update_firefly_positions(self):
         x_factor = int(self.canvas_length / 200)
         y_factor = int(self.canvas_width / 200)
         moved = 0
-        for firefly in self.fireflies:
+        x_ops, y_ops = random_steps(len(self.fireflies))
+        occupied = Occupancy((firefly.x, firefly.y) for firefly in self.fireflies)
+        for firefly, x_op, y_op in zip(self.fireflies, x_ops.tolist(), y_ops.tolist()):
             old_x = firefly.x
             old_y = firefly.y
-            x_op = randint(0, 1)
-            y_op = randint(0, 1)
             if x_op == 1:
                 # x + x-factor
                 new_x = old_x + x_factor if old_x + x_factor <= self.canvas_length else old_x
@@ -130,40 +180,77 @@ class FirefliesSimulation:
             else:
                 # y - y-factor
                 new_y = old_y - y_factor if old_y - y_factor >= 0 else old_y
-            other_firefly_present = False
-            for other_firefly in self.fireflies:
-                # If there's some other firefly in the new position, stay where you are
-                if other_firefly.x == new_x and other_firefly.y == new_y:
-                    other_firefly_present = True
-                    break
-            if not other_firefly_present:
+            # If there's some other firefly in the new position, stay where you are
+            if (new_x, new_y) not in occupied:
                 # print "({0}, {1}) changed position to ({2}, {3})".format(old_x, old_y, new_x, new_y)
+                occupied.move((old_x, old_y), (new_x, new_y))
                 firefly.x = new_x
                 firefly.y = new_y
                 moved += 1
         # print "{0} fireflies moved @{1}".format(moved, self.time)
+        return moved
 
     # Private method to update firefly neighbors
     def update_firefly_neighbors(self):
-        for firefly in self.fireflies:
-            firefly.neighbors = []
+        xs = [firefly.x for firefly in self.fireflies]
+        ys = [firefly.y for firefly in self.fireflies]
+        self.grid = update_grid(self.grid, xs, ys, self.neighbor_distance)
+        firsts, seconds = self.grid.pairs(self.neighbor_distance)
+        set_neighbors(self.fireflies, CSRAdjacency.from_pairs(len(self.fireflies), firsts, seconds))
 
-        for firefly1 in self.fireflies:
-            for firefly2 in self.fireflies:
-                x1 = firefly1.x
-                y1 = firefly1.y
-                x2 = firefly2.x
-                y2 = firefly2.y
-                if firefly1 != firefly2 and sqrt((x2 - x1)**2 + (y2 - y1)**2) < self.neighbor_distance:
-                    firefly1.neighbors.append(firefly2)
+    # Number of (directed) neighbor edges
+    def count_edges(self):
+        return sum(len(firefly.neighbors) for firefly in self.fireflies)
 
     def move_fireflies(self):
         self.update_firefly_positions()
         self.update_firefly_neighbors()
 
     # To start the simulation
-    def start_simulation(self, until=10000000, visualize=False):
-        filename = "logs/log__" + strftime("%d%m%Y_%H%M%S") + ".csv"
+    # With vectorized=True the population is stepped by the array engine
+    # log is 'csv', 'binary', a lib.runlog.RunLog (to pick the path, flush interval
+    # and decimation) or None to run without a log
+    # verbose=False silences the progress printed by runs without visualization
+    # With skip_idle=True (vectorized runs without movement or visualization) the ticks in which
+    # nobody flashes are applied in bulk, with the same log and progress output
+    # frames is a directory to save a PNG frame of every step in, or a lib.render.FrameWriter
+    # checkpoint is a file the state is saved to every checkpoint_every ticks (see restore_checkpoint)
+    # profile=True (or a lib.profiling.Profiler, to add observers) times every phase of the loop
+    # and counts flashes, nudges, moves, edges and log flushes; the profiler is kept in self.profiler
+    # stop is a lib.stopping.StopCriterion (or a list of them) which can end the run before it
+    # synchronizes; the criterion which did is kept in self.stopped_by. A CycleDetector hashes
+    # the clocks after every step and keeps up to max_states digests (about 16 MB by default)
+    # With processes=k the vectorized population is split into k strips of the canvas, each
+    # stepped by its own worker process (see lib.partition)
+    def start_simulation(self, until=10000000, visualize=False, vectorized=False, log='csv', verbose=True,
+                         skip_idle=False, frames=None, checkpoint=None, checkpoint_every=100000, profile=None,
+                         stop=None, processes=None):
+        steps = self.simulation_steps(until=until, visualize=visualize, vectorized=vectorized, log=log,
+                                      verbose=verbose, skip_idle=skip_idle, frames=frames, checkpoint=checkpoint,
+                                      checkpoint_every=checkpoint_every, profile=profile, stop=stop,
+                                      processes=processes)
+        for record in steps:
+            pass
+
+    # Run the simulation as a generator of lib.streaming.TickStats records, one every `every` ticks
+    # (with the indices of the fireflies which flashed if flashed=True), see lib.streaming
+    # The run only advances as records are taken, and ends when the generator is closed
+    # The other options are those of start_simulation, with no log and no progress output by default
+    def stream(self, until=10000000, every=1, flashed=False, log=None, verbose=False, **options):
+        return self.simulation_steps(until=until, log=log, verbose=verbose, stream_every=every,
+                                     stream_flashed=flashed, **options)
+
+    # Private generator running the simulation loop for start_simulation and stream
+    # It yields the records of the ticks kept by stream_every (none if it is None)
+    def simulation_steps(self, until=10000000, visualize=False, vectorized=False, log='csv', verbose=True,
+                         skip_idle=False, frames=None, checkpoint=None, checkpoint_every=100000, profile=None,
+                         stop=None, processes=None, stream_every=None, stream_flashed=False):
+        if skip_idle and not vectorized:
+            raise ValueError("Skipping idle ticks needs the vectorized engine")
+        if processes is not None and not vectorized:
+            raise ValueError("Running on several processes needs the vectorized engine")
+
+        run_log = make_run_log(log)
         param_string = "total fireflies:{0}, neighbor distance:{1}, nudge:{2}\n".format(
             self.n, self.neighbor_distance, self.nudge_duration
         )
@@ -172,23 +259,109 @@ class FirefliesSimulation:
         if visualize:
             self.visualization_init()
 
-        with open(filename, 'a+') as f:
-            f.write(param_string)
-            f.write("---------------------------------------------------\n")
-            f.write("iteration,mean,std,num\n")
+        # Frames are drawn and saved off the simulation loop
+        frame_writer = frames
+        if frames is not None and not isinstance(frames, FrameWriter):
+            frame_writer = FrameWriter(frames, self.canvas_length, self.canvas_width)
+
+        # Pick what advances the simulation: the firefly objects or an array engine
+        if processes is not None:
+            self.engine = PartitionedEngine(self, processes)
+        elif vectorized:
+            self.engine = ArrayEngine(self)
+        stepper = self if self.engine is None else self.engine
+        skipping = skip_idle and not self.movement and not visualize and frame_writer is None
+
+        criteria = make_stop_criteria(stop)
+        self.stopped_by = None
+        for criterion in criteria:
+            criterion.reset(self)
+
+        if run_log is not None:
+            run_log.open(param_string)
+
+        next_checkpoint = (self.time // checkpoint_every + 1) * checkpoint_every
+
+        profiler = self.profiler = make_profiler(profile)
+        if profiler is not None:
+            profiler.set('edges', stepper.count_edges())
+            profiler.start()
+
+        # Whether the stats of the last tick are still to be computed
+        stale = False
+
+        # Position of every firefly object, to stream the indices of the ones which flashed
+        indices = None
+        if stream_every is not None and stream_flashed and self.engine is None:
+            indices = dict((id(firefly), k) for k, firefly in enumerate(self.fireflies))
+
+        try:
             while self.time < until:
+                # Jump straight to the tick in which the next firefly flashes
+                if skipping:
+                    idle = min(self.engine.idle_ticks(), until - self.time)
+                    if idle > 0:
+                        # Stats are only computed for the skipped ticks which are logged, printed or
+                        # streamed, and for the last one
+                        iterations = arange(self.time + 1, self.time + idle + 1)
+                        wanted = self.stats_wanted(iterations, run_log, verbose, stream_every)
+                        wanted[-1] = True
+                        means, stds, phase_metrics = self.engine.skip_ticks(idle, wanted)
+                        iterations = iterations[wanted]
+                        self.time += idle
+                        self.phase_metric = phase_metrics[-1].item()
+                        stale = False
+                        if run_log is not None:
+                            run_log.write_block(iterations, means, stds, zeros(len(iterations), dtype=int64),
+                                                phase_metrics)
+                        if verbose:
+                            shown = iterations % 100 == 0
+                            for time, metric in zip(iterations[shown].tolist(), phase_metrics[shown].tolist()):
+                                print("{0}: Degree of synchronization = {1}".format(time, metric))
+                        if stream_every is not None:
+                            kept = iterations % stream_every == 0
+                            nobody = empty(0, dtype=int64) if stream_flashed else None
+                            for time, curr_mean, curr_std, metric in zip(iterations[kept].tolist(),
+                                                                         means[kept].tolist(), stds[kept].tolist(),
+                                                                         phase_metrics[kept].tolist()):
+                                yield TickStats(time, curr_mean, curr_std, 0, metric, nobody)
+                        if checkpoint is not None and self.time >= next_checkpoint:
+                            self.save_checkpoint(checkpoint, run_log)
+                            next_checkpoint = (self.time // checkpoint_every + 1) * checkpoint_every
+                        if profiler is not None:
+                            profiler.lap('skip')
+                            profiler.count('skipped', idle)
+                            profiler.tick(self.time)
+                        if criteria and self.check_stop_criteria(criteria, 0):
+                            break
+                        continue
+
                 # Update the clocks
-                self.update_firefly_clocks()
+                stepper.update_firefly_clocks()
+                if profiler is not None:
+                    profiler.lap('clocks')
 
                 # Make the fireflies flash
-                flashed = self.flash_fireflies()
+                flashed = stepper.flash_fireflies()
+                if profiler is not None:
+                    profiler.lap('flash')
+                    profiler.count('flashes', len(flashed))
 
                 # Make them appear on the canvas
-                if visualize:
-                    self.visualize_flashed_fireflies(flashed)
+                if visualize or frame_writer is not None:
+                    xs, ys = self.get_flashed_positions(flashed)
+                    if visualize:
+                        self.visualize_flashed_fireflies(xs, ys)
+                    if frame_writer is not None:
+                        frame_writer.add_frame(xs, ys)
+                    if profiler is not None:
+                        profiler.lap('render')
 
                 # Do the local communication i.e. nudge the clocks
-                self.do_local_communication(flashed)
+                nudged = stepper.do_local_communication(flashed)
+                if profiler is not None:
+                    profiler.lap('communication')
+                    profiler.count('nudges', nudged)
 
                 # Turn off the lights of the fireflies
                 if visualize:
@@ -196,45 +369,175 @@ class FirefliesSimulation:
                     self.wait()
 
                     # Set the background color as black
-                    self.space.fill(black)
-                    pygame.display.update()
+                    self.renderer.clear()
+                    if profiler is not None:
+                        profiler.lap('render')
 
                 if self.movement:
                     if self.time % 10 == 0:
-                        self.move_fireflies()
+                        moved = stepper.update_firefly_positions()
+                        if profiler is not None:
+                            profiler.lap('movement')
+                            profiler.count('moved', moved)
+                        stepper.update_firefly_neighbors()
+                        if profiler is not None:
+                            profiler.lap('neighbors')
+                            profiler.set('edges', stepper.count_edges())
 
                 # Increment the time
                 self.time += 1
 
-                curr_mean, curr_std, phase_metric = self.get_sim_stats()
-                f.write("{0},{1},{2},{3},{4}\n".format(self.time,
-                                                       curr_mean,
-                                                       curr_std,
-                                                       len(flashed),
-                                                       phase_metric))
-                f.flush()
-
-                if not visualize:
+                # Stats are only computed for the ticks which are logged, printed, streamed or
+                # checkpointed, and the ones in which every firefly flashed (to check the synchronization)
+                stale = not (len(flashed) == self.n or (checkpoint is not None and self.time >= next_checkpoint) or
+                             self.stats_wanted(self.time, run_log, verbose and not visualize, stream_every))
+                if not stale:
+                    curr_mean, curr_std, phase_metric = stepper.get_sim_stats()
+                    self.phase_metric = phase_metric
+                    if profiler is not None:
+                        profiler.lap('stats')
+                    if run_log is not None:
+                        run_log.write(self.time, curr_mean, curr_std, len(flashed), phase_metric)
+
+                if verbose and not visualize:
                     if self.time % 100 == 0:
-                        print "{0}: Degree of synchronization = {1}".format(self.time, phase_metric)
+                        print("{0}: Degree of synchronization = {1}".format(self.time, phase_metric))
+                if profiler is not None:
+                    profiler.lap('logging')
+
+                if stream_every is not None and self.time % stream_every == 0:
+                    flashed_indices = None
+                    if stream_flashed:
+                        flashed_indices = (flashed if indices is None else
+                                           array([indices[id(firefly)] for firefly in flashed], dtype=int64))
+                    yield TickStats(self.time, curr_mean, curr_std, len(flashed), phase_metric, flashed_indices)
+                    if profiler is not None:
+                        profiler.lap('streaming')
+
+                if checkpoint is not None and self.time >= next_checkpoint:
+                    self.save_checkpoint(checkpoint, run_log)
+                    next_checkpoint = (self.time // checkpoint_every + 1) * checkpoint_every
+                    if profiler is not None:
+                        profiler.lap('checkpoint')
+
+                if profiler is not None:
+                    profiler.count('ticks')
+                    if run_log is not None:
+                        profiler.set('flushes', run_log.flushes)
+                    profiler.tick(self.time)
 
                 # If fully synchronized
                 if len(flashed) == self.n and phase_metric == 0:
+                    self.synchronized_at = self.time
+                    break
+
+                # If the run settled without synchronizing
+                if criteria and self.check_stop_criteria(criteria, len(flashed)):
                     break
 
+            # The phase metric of the last tick, if it wasn't computed
+            if stale:
+                self.phase_metric = stepper.get_sim_stats()[2]
+        finally:
+            if self.engine is not None:
+                self.engine.close()
+            if run_log is not None:
+                run_log.close()
+            if frame_writer is not None:
+                frame_writer.close()
+            if profiler is not None:
+                if run_log is not None:
+                    profiler.set('flushes', run_log.flushes)
+                profiler.stop(self.time)
+
+            # Hand the final state back to the firefly objects (also when a stream is closed early)
+            if self.engine is not None:
+                self.engine.store()
+                self.engine = None
+
+        if profiler is not None and verbose:
+            print(profiler.summary())
+
+    # Private method to tell whether the stats of a tick (or of each tick of an array) are
+    # needed: the ones of the rows which are logged, printed as progress or streamed
+    @staticmethod
+    def stats_wanted(times, run_log, verbose, stream_every):
+        wanted = times % 100 == 0 if verbose else times < 0
+        if run_log is not None:
+            wanted = wanted | run_log.keeps(times)
+        if stream_every is not None:
+            wanted = wanted | (times % stream_every == 0)
+        return wanted
+
+    # Private method to check the stop criteria at the end of a step
+    # Every criterion is checked, as some of them follow the whole sequence of states
+    def check_stop_criteria(self, criteria, flashes):
+        met = [criterion for criterion in criteria if criterion.check(self, flashes)]
+        if met:
+            self.stopped_by = met[0]
+        return len(met) > 0
+
+    # Clocks and periods of the fireflies as arrays (those of the engine while it is running)
+    def get_clock_state(self):
+        if self.engine is not None:
+            return self.engine.clocks, self.engine.periods
+        return (array([firefly.clock for firefly in self.fireflies]),
+                array([firefly.period for firefly in self.fireflies]))
+
+    # Save the state of the simulation (and of the random module) to a checkpoint file
+    # The rows of the run log up to now are written out first, so the log matches the checkpoint
+    def save_checkpoint(self, path, run_log=None):
+        if run_log is not None:
+            run_log.flush()
+        save_checkpoint(self, path)
+
+    # Continue from a checkpoint: build the simulation with the same parameters, restore
+    # the checkpoint and start the simulation again with the same until
+    # With warm_start=True only the fireflies are taken from the checkpoint, e.g. to
+    # start the runs of a sweep from the same settled population
+    def restore_checkpoint(self, path, warm_start=False):
+        restore_checkpoint(self, path, warm_start=warm_start)
+
+    # Run independent replicates of a configuration at once on the ensemble engine
+    # Every replicate is a simulation built with the given keyword arguments, so it gets
+    # its own placement and initial clocks. Replicates stop as soon as they synchronize.
+    # This method returns the replicates, each with its synchronized_at and phase_metric set
+    @classmethod
+    def run_ensemble(cls, replicates, until=10000000, **params):
+        simulations = [cls(**params) for _ in range(replicates)]
+        EnsembleEngine(simulations).run(until)
+        return simulations
+
     # Get simulation stats
     def get_sim_stats(self):
-        total_phase_distance = 0
+        curr_clocks = [firefly.clock for firefly in self.fireflies]
+        deltas = []
         for firefly in self.fireflies:
             f_clock = firefly.clock
-            for neighbor in firefly.neighbors:
-                n_clock = neighbor.clock
+            for j in firefly.neighbors.tolist():
+                n_clock = curr_clocks[j]
                 delta = abs(f_clock - n_clock)
                 # if delta > 30:
                 #     delta -= 30
-                total_phase_distance += delta
-        curr_clocks = [firefly.clock for firefly in self.fireflies]
-        return mean(curr_clocks), std(curr_clocks), total_phase_distance
+                deltas.append(delta)
+        # Float distances are summed with fsum, like the engines do (see lib.engine.phase_distance)
+        if self.has_integral_clocks(curr_clocks):
+            curr_mean, curr_std = integer_mean_std(sum(curr_clocks), sum(clock * clock for clock in curr_clocks),
+                                                   len(curr_clocks))
+            return curr_mean, curr_std, sum(deltas)
+        return mean(curr_clocks), std(curr_clocks), fsum(deltas)
+
+    # Whether the clocks are integral and stay so under the rules of the population and the nudge,
+    # in which case their mean and std are computed like the array engines do (integer_mean_std)
+    def has_integral_clocks(self, clocks):
+        if isinstance(self.nudge_duration, float) or len(clocks) == 0:
+            return False
+        if not all(isinstance(clock, Integral) for clock in clocks):
+            return False
+        kinds = set(firefly.__class__ for firefly in self.fireflies)
+        rules = ([update_rules.get(kind.update_rule) for kind in kinds] +
+                 [nudge_rules.get(kind.nudge_rule) for kind in kinds])
+        return all(rule is not None and rule.integral for rule in rules)
 
     # Duration of every simulation step
     @staticmethod
@@ -244,4 +547,4 @@ class FirefliesSimulation:
     # Exit the simulation
     @staticmethod
     def exit_simulation():
-        pygame.quit()
+        quit_display()
@@ -0,0 +1,91 @@
+# File which includes the memory report of a simulation
+#
+# The report measures what a population takes: the firefly objects (with the attribute
+# values they don't share with others), the list holding them, the neighbor index arrays
+# and, while an engine runs, the engine's arrays. It gives the bytes per firefly and per
+# directed neighbor edge, from which larger runs can be sized with estimate_bytes.
+
+import sys
+import numpy as np
+
+firefly_attributes = ('x', 'y', 'period', 'clock', 'last_nudged_at')
+
+
+# Bytes of a value of its own (small ints are shared by the interpreter)
+def value_bytes(value):
+    if isinstance(value, int) and -5 <= value <= 256:
+        return 0
+    return sys.getsizeof(value)
+
+
+# Bytes of a firefly object, its attribute values and the header of its neighbor array
+def firefly_bytes(firefly):
+    size = sys.getsizeof(firefly)
+    for name in firefly_attributes:
+        size += value_bytes(getattr(firefly, name))
+    neighbors = firefly.neighbors
+    if isinstance(neighbors, np.ndarray):
+        size += sys.getsizeof(neighbors) - (neighbors.nbytes if neighbors.base is None else 0)
+    else:
+        size += sys.getsizeof(neighbors)
+    if hasattr(firefly, '__dict__'):
+        size += sys.getsizeof(firefly.__dict__)
+    return size
+
+
+# Bytes of the neighbor indices of a population (the arrays the neighbors are views into)
+def neighbor_bytes(fireflies):
+    arrays = {}
+    for firefly in fireflies:
+        neighbors = firefly.neighbors
+        if isinstance(neighbors, np.ndarray):
+            base = neighbors if neighbors.base is None else neighbors.base
+            arrays[id(base)] = base.nbytes
+        else:
+            arrays[id(neighbors)] = 8 * len(neighbors)
+    return sum(arrays.values())
+
+
+# Bytes of the arrays held by an engine and its adjacency
+def engine_bytes(engine):
+    if engine is None:
+        return 0
+    size = sum(value.nbytes for value in vars(engine).values() if isinstance(value, np.ndarray))
+    adjacency = getattr(engine, 'adjacency', None)
+    if adjacency is not None:
+        size += adjacency.indptr.nbytes + adjacency.indices.nbytes
+    return size
+
+
+# Memory taken by a simulation, as a dict of byte counts
+def memory_report(sim):
+    fireflies = sim.fireflies
+    n = len(fireflies)
+    edges = sum(len(firefly.neighbors) for firefly in fireflies)
+    objects = sum(firefly_bytes(firefly) for firefly in fireflies) + sys.getsizeof(fireflies)
+    neighbors = neighbor_bytes(fireflies)
+    return {
+        'fireflies': n,
+        'edges': edges,
+        'object_bytes': objects,
+        'neighbor_bytes': neighbors,
+        'engine_bytes': engine_bytes(sim.engine),
+        'bytes_per_firefly': float(objects) / n if n > 0 else 0.0,
+        'bytes_per_edge': float(neighbors) / edges if edges > 0 else 0.0,
+    }
+
+
+# Bytes a population of n fireflies with the given number of edges would take, at the rates of a report
+def estimate_bytes(report, n, edges):
+    return int(n * report['bytes_per_firefly'] + edges * report['bytes_per_edge'])
+
+
+def format_memory_report(report):
+    return "\n".join([
+        "{0} fireflies, {1} edges".format(report['fireflies'], report['edges']),
+        "fireflies         {0:>14,} bytes ({1:.1f} per firefly)".format(report['object_bytes'],
+                                                                     report['bytes_per_firefly']),
+        "neighbor indices  {0:>14,} bytes ({1:.1f} per edge)".format(report['neighbor_bytes'],
+                                                                  report['bytes_per_edge']),
+        "engine arrays     {0:>14,} bytes".format(report['engine_bytes']),
+    ])
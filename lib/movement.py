@@ -0,0 +1,74 @@
+# File which includes the helpers used to move the fireflies around the canvas
+
+import numpy as np
+from binascii import unhexlify
+from random import getrandbits
+
+
+# Draw the random direction of every firefly's step in one batch
+# This method returns two 0/1 arrays: x_ops (1 means x + x-factor) and y_ops (1 means y + y-factor)
+def random_steps(n):
+    if n == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8)
+
+    n_bytes = (2 * n + 7) // 8
+    raw = unhexlify('%0*x' % (2 * n_bytes, getrandbits(8 * n_bytes)))
+    bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8))
+    return bits[0:2 * n:2], bits[1:2 * n:2]
+
+
+# Positions the fireflies step to, clamped at the canvas bounds
+def step_positions(xs, ys, x_ops, y_ops, x_factor, y_factor, canvas_length, canvas_width):
+    forward_x = np.where(xs + x_factor <= canvas_length, xs + x_factor, xs)
+    backward_x = np.where(xs - x_factor >= 0, xs - x_factor, xs)
+    forward_y = np.where(ys + y_factor <= canvas_width, ys + y_factor, ys)
+    backward_y = np.where(ys - y_factor >= 0, ys - y_factor, ys)
+    return np.where(x_ops == 1, forward_x, backward_x), np.where(y_ops == 1, forward_y, backward_y)
+
+
+# Count of fireflies per occupied position
+class Occupancy:
+    def __init__(self, positions=()):
+        self.counts = {}
+        for position in positions:
+            self.counts[position] = self.counts.get(position, 0) + 1
+
+    def __contains__(self, position):
+        return position in self.counts
+
+    def move(self, old_position, new_position):
+        if self.counts[old_position] == 1:
+            del self.counts[old_position]
+        else:
+            self.counts[old_position] -= 1
+        self.counts[new_position] = self.counts.get(new_position, 0) + 1
+
+
+# Decide which fireflies get to move to their new positions
+# The fireflies are considered one after another, and a firefly stays where it is if
+# its new position is occupied at its turn (including by itself, when it can't step).
+# Only the fireflies whose new position clashes with some other position are resolved
+# one by one; everybody else moves freely.
+# This method returns a boolean mask of the fireflies which moved
+def resolve_moves(xs, ys, new_xs, new_ys, canvas_width):
+    old_keys = xs * (canvas_width + 1) + ys
+    new_keys = new_xs * (canvas_width + 1) + new_ys
+
+    # A new position clashes if it is taken right now, or if somebody else wants it too
+    unique_keys, inverse, counts = np.unique(new_keys, return_inverse=True, return_counts=True)
+    clashing = np.isin(new_keys, old_keys) | (counts[inverse] > 1)
+
+    # The fireflies standing on a clashing position decide whether it is free at each turn
+    involved = clashing | np.isin(old_keys, new_keys[clashing])
+
+    moved = ~involved
+    indices = np.flatnonzero(involved)
+    if len(indices) > 0:
+        old_involved = old_keys[indices].tolist()
+        new_involved = new_keys[indices].tolist()
+        occupied = Occupancy(old_involved)
+        for k, i in enumerate(indices.tolist()):
+            if new_involved[k] not in occupied:
+                occupied.move(old_involved[k], new_involved[k])
+                moved[i] = True
+    return moved
@@ -0,0 +1,191 @@
+# File which includes the spatial index used to find the neighbors of fireflies
+#
+# The canvas is cut into square cells as wide as the neighbor distance, so all
+# neighbors of a firefly are found in its own cell and the eight cells around it.
+
+import numpy as np
+
+# Upper bound on the size of a block of pairwise distances computed at once
+block_size = 1 << 20
+
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        # A cell can't be narrower than a pixel
+        self.cell_size = max(cell_size, 1)
+
+        self.xs = np.zeros(0, dtype=np.int64)
+        self.ys = np.zeros(0, dtype=np.int64)
+        self.cell_xs = np.zeros(0, dtype=np.int64)
+        self.cell_ys = np.zeros(0, dtype=np.int64)
+
+        # Cell coordinates -> indices of the fireflies inside
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    # Private method to compute the cell coordinates of positions
+    def locate(self, xs, ys):
+        return (xs // self.cell_size).astype(np.int64), (ys // self.cell_size).astype(np.int64)
+
+    # Index the fireflies at the given positions from scratch
+    def build(self, xs, ys):
+        self.xs = np.array(xs, dtype=np.int64)
+        self.ys = np.array(ys, dtype=np.int64)
+        self.cell_xs, self.cell_ys = self.locate(self.xs, self.ys)
+
+        self.cells = {}
+        for i, cell in enumerate(zip(self.cell_xs.tolist(), self.cell_ys.tolist())):
+            self.cells.setdefault(cell, set()).add(i)
+
+    # Update the positions of the fireflies
+    # Only the fireflies which crossed into another cell touch the index
+    # This method returns the number of fireflies which changed cells
+    def move(self, xs, ys):
+        self.xs = np.array(xs, dtype=np.int64)
+        self.ys = np.array(ys, dtype=np.int64)
+        cell_xs, cell_ys = self.locate(self.xs, self.ys)
+
+        crossed = np.flatnonzero((cell_xs != self.cell_xs) | (cell_ys != self.cell_ys))
+        for i in crossed.tolist():
+            old_cell = (int(self.cell_xs[i]), int(self.cell_ys[i]))
+            new_cell = (int(cell_xs[i]), int(cell_ys[i]))
+            self.cells[old_cell].discard(i)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+            self.cells.setdefault(new_cell, set()).add(i)
+
+        self.cell_xs = cell_xs
+        self.cell_ys = cell_ys
+        return len(crossed)
+
+    # All ordered pairs (i, j), i != j, of fireflies closer than distance
+    # The pairs are returned as two index arrays sorted by i, then by j
+    def pairs(self, distance):
+        members = {}
+        for cell, indices in self.cells.items():
+            members[cell] = np.array(sorted(indices), dtype=np.intp)
+
+        firsts = [np.zeros(0, dtype=np.intp)]
+        seconds = [np.zeros(0, dtype=np.intp)]
+        for (cx, cy), own in members.items():
+            others = [members[(cx + dx, cy + dy)]
+                      for dx in (-1, 0, 1)
+                      for dy in (-1, 0, 1)
+                      if (cx + dx, cy + dy) in members]
+            others = np.concatenate(others)
+            other_xs = self.xs[others]
+            other_ys = self.ys[others]
+
+            # Keep the distance blocks bounded for crowded cells
+            step = max(1, block_size // len(others))
+            for start in range(0, len(own), step):
+                chunk = own[start:start + step]
+                dx = self.xs[chunk][:, np.newaxis] - other_xs[np.newaxis, :]
+                dy = self.ys[chunk][:, np.newaxis] - other_ys[np.newaxis, :]
+                close = np.sqrt(dx ** 2 + dy ** 2) < distance
+                close &= chunk[:, np.newaxis] != others[np.newaxis, :]
+                a, b = np.nonzero(close)
+                firsts.append(chunk[a])
+                seconds.append(others[b])
+
+        firsts = np.concatenate(firsts)
+        seconds = np.concatenate(seconds)
+        order = np.lexsort((seconds, firsts))
+        return firsts[order], seconds[order]
+
+
+# Compressed sparse-row adjacency of the neighbor graph
+# The neighbors of firefly i are indices[indptr[i]:indptr[i + 1]], in ascending order
+class CSRAdjacency:
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.n = len(indptr) - 1
+
+        # Row of every edge, built on first use
+        self.rows = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    # Build the adjacency of n fireflies from the (i, j) pairs returned by SpatialGrid.pairs
+    @classmethod
+    def from_pairs(cls, n, firsts, seconds):
+        # indptr has to address every edge
+        index_type = np.int32 if len(firsts) <= np.iinfo(np.int32).max else np.int64
+        indptr = np.zeros(n + 1, dtype=index_type)
+        np.cumsum(np.bincount(firsts, minlength=n), out=indptr[1:])
+        return cls(indptr, np.asarray(seconds, dtype=np.int32))
+
+    # Block-diagonal adjacency of independent graphs, the fireflies of every graph
+    # being numbered after the fireflies of the graphs before it
+    @classmethod
+    def stack(cls, adjacencies):
+        n_edges = sum(len(adjacency) for adjacency in adjacencies)
+        index_type = np.int32 if n_edges <= np.iinfo(np.int32).max else np.int64
+        indptrs = [np.zeros(1, dtype=index_type)]
+        indices = [np.zeros(0, dtype=np.int32)]
+        node_offset = 0
+        edge_offset = 0
+        for adjacency in adjacencies:
+            indptrs.append(adjacency.indptr[1:].astype(index_type) + edge_offset)
+            indices.append(adjacency.indices + node_offset)
+            node_offset += adjacency.n
+            edge_offset += len(adjacency)
+        return cls(np.concatenate(indptrs), np.concatenate(indices).astype(np.int32))
+
+    # Row and column of every edge
+    def edges(self):
+        if self.rows is None:
+            self.rows = np.repeat(np.arange(self.n, dtype=np.int32), np.diff(self.indptr))
+        return self.rows, self.indices
+
+    # Neighbors of the given fireflies, concatenated (with repetitions) in a single gather
+    def gather(self, rows):
+        return self.gather_edges(rows)[1]
+
+    # Edges leaving the given fireflies, as (row, neighbor) arrays
+    def gather_edges(self, rows):
+        rows = np.asarray(rows)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=rows.dtype), np.zeros(0, dtype=self.indices.dtype)
+
+        # Position of every gathered edge: its row start plus its offset inside the row
+        ends = np.cumsum(counts)
+        offsets = np.arange(total) - np.repeat(ends - counts, counts)
+        return np.repeat(rows, counts), self.indices[np.repeat(starts, counts) + offsets]
+
+    # Neighbors of a single firefly
+    def neighbors_of(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+
+# Reuse the grid if it still indexes the same population with the same cell size,
+# otherwise index the positions from scratch
+def update_grid(grid, xs, ys, cell_size):
+    if grid is None or len(grid) != len(xs) or grid.cell_size != max(cell_size, 1):
+        grid = SpatialGrid(cell_size)
+        grid.build(xs, ys)
+    else:
+        grid.move(xs, ys)
+    return grid
+
+
+# Index the given positions and return the neighbor pairs closer than distance
+def neighbor_pairs(xs, ys, distance):
+    grid = SpatialGrid(distance)
+    grid.build(xs, ys)
+    return grid.pairs(distance)
+
+
+# Give every firefly the indices of its neighbors, as views into the indices of the adjacency
+def set_neighbors(fireflies, adjacency):
+    indptr = adjacency.indptr.tolist()
+    indices = adjacency.indices
+    for i, firefly in enumerate(fireflies):
+        firefly.neighbors = indices[indptr[i]:indptr[i + 1]]
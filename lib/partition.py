@@ -0,0 +1,266 @@
+# File which includes the partitioned engine, which spreads a population over processes
+#
+# The canvas is cut into vertical strips, each owned by a worker process. The state of the
+# population lives in shared memory, and a worker only writes the entries of the fireflies
+# inside its strip: it updates their clocks, flags the ones which flash in the shared flash
+# buffer and nudges the ones next to a flash. The flags of the fireflies in the neighboring
+# strips, less than the neighbor distance away from its borders, are its halo: it reads them
+# from the shared flash buffer once every worker flagged its flashes for the tick.
+#
+# Every worker builds the neighbors of its own fireflies from the fireflies in its strip and
+# its halo, and writes them to a shared edge buffer in the order of the single-process
+# adjacency. The master process moves the fireflies (with the same random stream as the
+# array engine), after which every worker takes over the fireflies now inside its strip,
+# and computes the statistics from the shared buffers with the same operations as the
+# array engine. Seeded runs give the same clocks, positions, flashes and log as ArrayEngine.
+
+import ctypes
+import numpy as np
+from multiprocessing import Pipe, Process
+from multiprocessing.sharedctypes import RawArray
+from lib.engine import ArrayEngine, phase_distance
+from lib.neighbors import CSRAdjacency, neighbor_pairs
+from lib.rules import apply_rules, nudge_rules, population_rules, update_rules
+
+
+# New block of shared memory holding a copy of values
+# It is passed around as (buffer, dtype, size), which the workers can inherit however they are started
+def share(values):
+    values = np.asarray(values)
+    block = (RawArray(ctypes.c_char, max(1, values.nbytes)), values.dtype.str, values.size)
+    view(block)[:] = values
+    return block
+
+
+# Numpy array over a block of shared memory
+def view(block):
+    buffer, dtype, size = block
+    return np.frombuffer(buffer, dtype=dtype, count=size)
+
+
+# Worker process owning the fireflies with lower <= x < upper
+class StripWorker:
+    def __init__(self, blocks, rule_names, lower, upper, neighbor_distance):
+        self.state = dict((name, view(block)) for name, block in blocks.items())
+        self.lower = lower
+        self.upper = upper
+        self.neighbor_distance = neighbor_distance
+        self.n = len(self.state['xs'])
+
+        # Rules of the population; the codes are shared by all the workers
+        update_names, nudge_names = rule_names
+        self.update_rules = population_rules(update_rules, update_names)[0]
+        self.nudge_rules = population_rules(nudge_rules, nudge_names)[0]
+
+        # Own fireflies, and the (row, column) of every edge leaving them
+        self.owned = None
+        self.rows = None
+        self.local_rows = None
+        self.columns = None
+        self.slots = None
+
+    # Take the fireflies inside the strip and build their neighbors from the strip and its halo
+    # This method returns the number of edges leaving the strip's fireflies
+    def rebuild(self):
+        xs = self.state['xs']
+        ys = self.state['ys']
+        distance = self.neighbor_distance
+        inside = (xs >= self.lower) & (xs < self.upper)
+        self.owned = np.flatnonzero(inside)
+
+        # Neighbors are less than distance away, so the halo is that far around the strip
+        candidates = np.flatnonzero((xs > self.lower - distance) & (xs < self.upper - 1 + distance))
+        firsts, seconds = neighbor_pairs(xs[candidates], ys[candidates], distance)
+        keep = inside[candidates[firsts]]
+        self.rows = candidates[firsts[keep]]
+        self.columns = candidates[seconds[keep]]
+        self.local_rows = np.searchsorted(self.owned, self.rows)
+
+        degrees = self.state['degrees']
+        degrees[self.owned] = np.bincount(self.local_rows, minlength=len(self.owned))
+        self.slots = None
+        return len(self.rows)
+
+    # Position of the edges in the single-process adjacency, once every strip wrote its degrees
+    def index(self):
+        indptr = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(self.state['degrees'], out=indptr[1:])
+        row_starts = np.searchsorted(self.local_rows, np.arange(len(self.owned)))
+        offsets = np.arange(len(self.rows)) - row_starts[self.local_rows]
+        self.slots = indptr[self.rows] + offsets
+        self.state['edge_columns'][self.slots] = self.columns
+
+    # Update the clocks of the strip and flag the fireflies which flash
+    # This method returns the number of fireflies which flashed
+    def flash(self):
+        clocks = self.state['clocks']
+        periods = self.state['periods']
+        apply_rules(self.update_rules, self.state['update_codes'], self.owned, clocks, periods)
+
+        flashed = self.owned[clocks[self.owned] >= periods[self.owned]]
+        clocks[flashed] = 0
+        flags = self.state['flashed']
+        flags[self.owned] = 0
+        flags[flashed] = 1
+        return len(flashed)
+
+    # Nudge, at most once per time step, the fireflies of the strip next to a flash
+    # This method returns the number of fireflies which were nudged
+    def nudge(self, time, nudge):
+        flags = self.state['flashed']
+        clocks = self.state['clocks']
+        last_nudged_at = self.state['last_nudged_at']
+        hits = np.bincount(self.local_rows, weights=flags[self.columns], minlength=len(self.owned))
+        nudged = self.owned[hits > 0]
+        nudged = nudged[last_nudged_at[nudged] != time]
+
+        apply_rules(self.nudge_rules, self.state['nudge_codes'], nudged, clocks, self.state['periods'], nudge)
+        clocks[nudged] = np.where(clocks[nudged] < 0, 0, clocks[nudged])
+        last_nudged_at[nudged] = time
+        return len(nudged)
+
+    # Phase distance of every edge leaving the strip, in the shared edge buffer
+    def phase_terms(self):
+        clocks = self.state['clocks']
+        self.state['edge_terms'][self.slots] = np.abs(clocks[self.rows] - clocks[self.columns])
+
+    # Serve the commands of the master until told to stop
+    def serve(self, connection):
+        while True:
+            command = connection.recv()
+            if command[0] == 'stop':
+                break
+            connection.send(getattr(self, command[0])(*command[1:]))
+        connection.close()
+
+
+def run_worker(connection, blocks, rule_names, lower, upper, neighbor_distance):
+    StripWorker(blocks, rule_names, lower, upper, neighbor_distance).serve(connection)
+
+
+class PartitionedEngine(ArrayEngine):
+    def __init__(self, simulation, processes=2):
+        self.processes = max(1, processes)
+        self.connections = []
+        self.workers = []
+        self.blocks = None
+        self.shared = None
+        self.edges = 0
+        ArrayEngine.__init__(self, simulation)
+
+    # Private method to move the state into shared memory, with room for capacity edges
+    def share_state(self, capacity):
+        blocks = self.blocks or {}
+        for name in ('xs', 'ys', 'clocks', 'periods', 'last_nudged_at', 'update_codes', 'nudge_codes'):
+            blocks[name] = share(getattr(self, name))
+        if 'flashed' not in blocks:
+            blocks['flashed'] = share(np.zeros(self.n, dtype=np.int8))
+            blocks['degrees'] = share(np.zeros(self.n, dtype=np.int64))
+        blocks['edge_columns'] = share(np.zeros(capacity, dtype=np.int32))
+        blocks['edge_terms'] = share(np.zeros(capacity, dtype=self.clocks.dtype))
+
+        self.blocks = blocks
+        self.shared = dict((name, view(block)) for name, block in blocks.items())
+        for name in ('xs', 'ys', 'clocks', 'periods', 'last_nudged_at', 'update_codes', 'nudge_codes'):
+            setattr(self, name, self.shared[name])
+
+    # Private method to start a worker per strip of the canvas
+    def start_workers(self):
+        bounds = np.linspace(0, self.sim.canvas_length + 1, self.processes + 1).astype(np.int64).tolist()
+        rule_names = ([rule.name for rule in self.update_rules], [rule.name for rule in self.nudge_rules])
+        for k in range(self.processes):
+            master_end, worker_end = Pipe()
+            worker = Process(target=run_worker, args=(worker_end, self.blocks, rule_names, bounds[k], bounds[k + 1],
+                                                      self.sim.neighbor_distance))
+            worker.daemon = True
+            worker.start()
+            worker_end.close()
+            self.connections.append(master_end)
+            self.workers.append(worker)
+
+    # Private method to run a command on every worker and return their answers
+    def request(self, *command):
+        for connection in self.connections:
+            connection.send(command)
+        return [connection.recv() for connection in self.connections]
+
+    # Stop the worker processes
+    def close(self):
+        for connection in self.connections:
+            connection.send(('stop',))
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+    # The clocks are updated by the workers together with the flashes
+    def update_firefly_clocks(self):
+        pass
+
+    # Private method to make the fireflies flash
+    # This method returns the indices of fireflies which flashed in this simulation time step
+    def flash_fireflies(self):
+        self.request('flash')
+        return np.flatnonzero(self.shared['flashed'])
+
+    # Private method to nudge the clocks
+    # This method returns the number of fireflies which were nudged
+    def do_local_communication(self, flashed):
+        if len(flashed) == 0:
+            return 0
+        return sum(self.request('nudge', self.sim.time, self.sim.nudge_duration))
+
+    # Private method to update firefly neighbors
+    # The workers take the fireflies of their strip and rebuild their neighbors; they are
+    # started again with a larger edge buffer if the current one is too small
+    def update_firefly_neighbors(self):
+        if self.shared is None:
+            self.share_state(capacity=16 * self.n)
+            self.start_workers()
+
+        self.edges = sum(self.request('rebuild'))
+        if self.edges > len(self.shared['edge_terms']):
+            self.close()
+            self.share_state(capacity=2 * self.edges)
+            self.start_workers()
+            self.request('rebuild')
+        self.request('index')
+        self.adjacency = None
+        self.stats_valid = False
+
+    # Neighbors in compressed sparse-row form, as written by the workers
+    def get_adjacency(self):
+        if self.adjacency is None:
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            np.cumsum(self.shared['degrees'], out=indptr[1:])
+            self.adjacency = CSRAdjacency(indptr, self.shared['edge_columns'][:self.edges].copy())
+        return self.adjacency
+
+    def count_edges(self):
+        return self.edges
+
+    # Get simulation stats
+    # Computed from scratch every time, with the same operations as ArrayEngine
+    def get_sim_stats(self):
+        return self.get_full_sim_stats()
+
+    def get_full_sim_stats(self):
+        self.request('phase_terms')
+        total_phase_distance = phase_distance(self.shared['edge_terms'][:self.edges])
+
+        if self.incremental and self.n > 0:
+            self.clock_sum = int(self.clocks.sum())
+            self.clock_sumsq = int((self.clocks ** 2).sum())
+            self.phase_total = total_phase_distance
+            self.stats_valid = True
+            curr_mean, curr_std = self.get_running_mean_std()
+            return curr_mean, curr_std, total_phase_distance
+
+        curr_mean, curr_std = self.get_mean_std()
+        return curr_mean, curr_std, total_phase_distance
+
+    # Copy the state of the arrays back into the firefly objects
+    def store(self):
+        self.get_adjacency()
+        ArrayEngine.store(self)
@@ -0,0 +1,84 @@
+# File which includes the profiler of the simulation loop
+#
+# The loop calls lap(phase) after each of its phases, which adds the time since the
+# previous lap to that phase, and count(name, k) for its counters. Observers are called
+# with (time, profiler) every observe_every ticks and at the end of the run.
+# Without a profiler the loop only tests for None, so an unprofiled run costs nothing more.
+
+from timeit import default_timer
+
+# Phases of a simulation step, in the order the loop goes through them
+phases = ('clocks', 'flash', 'render', 'communication', 'movement', 'neighbors', 'stats', 'logging',
+          'streaming', 'checkpoint', 'skip')
+
+# Counters of the run: ticks stepped and skipped, fireflies flashed, nudged and moved,
+# directed neighbor edges (as of the last rebuild) and run log flushes
+counters = ('ticks', 'skipped', 'flashes', 'nudges', 'moved', 'edges', 'flushes')
+
+
+class Profiler:
+    def __init__(self, observers=None, observe_every=1000):
+        self.seconds = dict((phase, 0.0) for phase in phases)
+        self.counters = dict((name, 0) for name in counters)
+        self.observers = list(observers or [])
+        self.observe_every = max(1, observe_every)
+        self.started = None
+        self.last = None
+        self.elapsed = 0.0
+
+    # Register a callable, called with (time, profiler)
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    # Start timing (the first lap is measured from here)
+    def start(self):
+        self.started = self.last = default_timer()
+
+    # Add the time since the previous lap to a phase
+    def lap(self, phase):
+        now = default_timer()
+        self.seconds[phase] += now - self.last
+        self.last = now
+
+    def count(self, name, k=1):
+        self.counters[name] += k
+
+    # Set a counter which holds a current value rather than a total
+    def set(self, name, value):
+        self.counters[name] = value
+
+    # Called at the end of every step: notify the observers when it's their turn
+    def tick(self, time):
+        if self.observers and time % self.observe_every == 0:
+            self.notify(time)
+
+    def notify(self, time):
+        for observer in self.observers:
+            observer(time, self)
+
+    # Stop timing and notify the observers a last time
+    def stop(self, time):
+        self.elapsed = default_timer() - self.started
+        self.notify(time)
+
+    # Human readable report of the run
+    def summary(self):
+        lines = ["{0:<14} {1:>10} {2:>7}".format("phase", "seconds", "share")]
+        total = sum(self.seconds.values())
+        for phase in phases:
+            share = 100.0 * self.seconds[phase] / total if total > 0 else 0.0
+            lines.append("{0:<14} {1:>10.4f} {2:>6.1f}%".format(phase, self.seconds[phase], share))
+        lines.append("{0:<14} {1:>10.4f}".format("total", self.elapsed))
+        for name in counters:
+            lines.append("{0:<14} {1:>10}".format(name, self.counters[name]))
+        return "\n".join(lines)
+
+
+# Build the profiler asked for by start_simulation: a Profiler is used as it is,
+# True creates one and None (or False) turns profiling off
+def make_profiler(profile):
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return Profiler()
+    return profile
@@ -0,0 +1,171 @@
+# File which includes the renderers of flashing fireflies
+#
+# A flashing firefly lights the 6x6 square of pixels from (x - 3, y - 3) to (x + 2, y + 2),
+# folded back onto the canvas at the top and left borders like Firefly.light_up does.
+# The pixels of all the flashed fireflies are computed at once with numpy.
+#
+# pygame is only imported once something is shown or saved as PNG, so headless runs
+# (and worker processes) never load it nor need a display.
+
+import os
+import sys
+import numpy as np
+from threading import Thread
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+black = (0, 0, 0)
+white = (255, 255, 255)
+
+# Offsets of the pixels of a firefly's square
+offsets = np.arange(-3, 3)
+
+
+# Pixels lit by fireflies at the given positions, as (xs, ys) index arrays inside the canvas
+def square_pixels(xs, ys, canvas_length, canvas_width):
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    pixel_xs = np.abs(xs[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis])
+    pixel_ys = np.abs(ys[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :])
+    pixel_xs, pixel_ys = np.broadcast_arrays(pixel_xs, pixel_ys)
+    inside = (pixel_xs < canvas_length) & (pixel_ys < canvas_width)
+    return pixel_xs[inside], pixel_ys[inside]
+
+
+# Open the pygame window and return a Renderer drawing on it
+def init_display(canvas_length, canvas_width, caption='Fireflies'):
+    import pygame
+    pygame.init()
+    space = pygame.display.set_mode((canvas_length, canvas_width))
+    pygame.display.set_caption(caption)
+    space.fill(black)
+    pygame.display.update()
+    return Renderer(space)
+
+
+# Close the pygame window, if pygame was ever loaded
+def quit_display():
+    pygame = sys.modules.get('pygame')
+    if pygame is not None:
+        pygame.quit()
+
+
+# Smallest rectangles holding the squares of fireflies at the given positions
+def square_rects(xs, ys):
+    import pygame
+    rects = []
+    for x, y in zip(np.asarray(xs).tolist(), np.asarray(ys).tolist()):
+        left = max(x - 3, 0)
+        top = max(y - 3, 0)
+        rects.append(pygame.Rect(left, top, max(abs(x - 3), x + 2) - left + 1, max(abs(y - 3), y + 2) - top + 1))
+    return rects
+
+
+# Draws the flashed fireflies on a pygame surface and updates only the parts of the display they cover
+class Renderer:
+    def __init__(self, surface, display=True):
+        self.surface = surface
+        self.display = display
+        self.canvas_length, self.canvas_width = surface.get_size()
+
+        # Square of every position lit and not erased since the last clear
+        self.dirty = {}
+
+    # Light up the fireflies at the given positions
+    def draw(self, xs, ys):
+        rects = self.paint(xs, ys, white)
+        self.dirty.update(zip(zip(np.asarray(xs).tolist(), np.asarray(ys).tolist()), rects))
+
+    # Turn off the fireflies at the given positions
+    def erase(self, xs, ys):
+        self.paint(xs, ys, black)
+        for position in zip(np.asarray(xs).tolist(), np.asarray(ys).tolist()):
+            self.dirty.pop(position, None)
+
+    # Turn off everything lit since the last clear
+    def clear(self):
+        import pygame
+        rects = list(self.dirty.values())
+        self.dirty = {}
+        for rect in rects:
+            self.surface.fill(black, rect)
+        if self.display and rects:
+            pygame.display.update(rects)
+
+    # Private method to set the squares of the fireflies to a color
+    # This method returns the rectangles of the squares
+    def paint(self, xs, ys, color):
+        import pygame
+        if len(xs) == 0:
+            return []
+        pixel_xs, pixel_ys = square_pixels(xs, ys, self.canvas_length, self.canvas_width)
+        pixels = pygame.surfarray.pixels2d(self.surface)
+        pixels[pixel_xs, pixel_ys] = self.surface.map_rgb(color)
+        del pixels
+
+        rects = square_rects(xs, ys)
+        if self.display:
+            pygame.display.update(rects)
+        return rects
+
+
+# Writes a frame per simulation step on a background thread, so saving never holds up the simulation
+# Frames are saved as frame_<step>.png (pygame), or appended to frames.raw as canvas_width rows of
+# canvas_length bytes (0 or 255), which needs numpy only
+# When the writer falls behind by max_pending frames, new frames are dropped and counted
+class FrameWriter:
+    def __init__(self, path, canvas_length, canvas_width, frame_format='png', max_pending=256):
+        if frame_format not in ('png', 'raw'):
+            raise ValueError("Unknown frame format: {0}".format(frame_format))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.canvas_length = canvas_length
+        self.canvas_width = canvas_width
+        self.frame_format = frame_format
+        self.frames = 0
+        self.dropped = 0
+
+        self.queue = Queue(max_pending)
+        self.thread = Thread(target=self.write_frames)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queue the frame in which the fireflies at the given positions are lit
+    def add_frame(self, xs, ys):
+        try:
+            self.queue.put_nowait((self.frames, np.array(xs), np.array(ys)))
+        except Full:
+            self.dropped += 1
+        self.frames += 1
+
+    # Private method run by the background thread
+    def write_frames(self):
+        raw = open(os.path.join(self.path, "frames.raw"), 'ab') if self.frame_format == 'raw' else None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                index, xs, ys = item
+                frame = np.zeros((self.canvas_width, self.canvas_length), dtype=np.uint8)
+                pixel_xs, pixel_ys = square_pixels(xs, ys, self.canvas_length, self.canvas_width)
+                frame[pixel_ys, pixel_xs] = 255
+                if raw is not None:
+                    frame.tofile(raw)
+                else:
+                    import pygame
+                    surface = pygame.surfarray.make_surface(np.repeat(frame.T[:, :, np.newaxis], 3, axis=2))
+                    pygame.image.save(surface, os.path.join(self.path, "frame_{0:07d}.png".format(index)))
+        finally:
+            if raw is not None:
+                raw.close()
+
+    # Wait for the queued frames to be written
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
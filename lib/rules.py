@@ -0,0 +1,113 @@
+# File which includes the registry of the clock rules used by the array engines
+#
+# Every kind of firefly names the rule its clock is updated with (update_rule) and the rule
+# it is nudged with (nudge_rule). The rules are registered here under those names, with a
+# vectorized function, and get an integer code in the order they are registered. The
+# engines keep the code of every firefly in an array and apply each rule to the fireflies
+# with its code in one operation, so populations which mix kinds of fireflies run at
+# array speed. A new kind of firefly registers its rules the same way, e.g.
+#
+#   register_nudge_rule('halving', lambda clocks, periods, nudge: clocks / 2.0, integral=False)
+#
+# Update rules are called as rule(clocks, periods) and nudge rules as rule(clocks, periods, nudge),
+# and return the new clocks. A rule which can make integral clocks fractional is registered
+# with integral=False, so that the engines keep the clocks as floats.
+
+import numpy as np
+
+
+class Rule:
+    def __init__(self, name, code, function, integral):
+        self.name = name
+        self.code = code
+        self.function = function
+        self.integral = integral
+
+
+update_rules = {}
+nudge_rules = {}
+
+
+# Add a rule to a registry (a rule registered again keeps its code)
+# This method returns the code of the rule
+def register_rule(registry, name, function, integral=True):
+    code = registry[name].code if name in registry else len(registry)
+    registry[name] = Rule(name, code, function, integral)
+    return code
+
+
+def register_update_rule(name, function, integral=True):
+    return register_rule(update_rules, name, function, integral)
+
+
+def register_nudge_rule(name, function, integral=True):
+    return register_rule(nudge_rules, name, function, integral)
+
+
+# Vectorized counterparts of Firefly.update_clock
+def increment_clocks(clocks, periods):
+    return clocks + 1
+
+
+def strogatzian_clocks(clocks, periods):
+    delta = (periods + 1) - clocks
+    return clocks + (0.1 * delta)
+
+
+# Vectorized counterparts of Firefly.nudge_clock
+def symmetric_nudge(clocks, periods, nudge):
+    return np.where(clocks >= (periods / 2), clocks + nudge, clocks - nudge)
+
+
+def adversarial_nudge(clocks, periods, nudge):
+    return np.where(clocks >= (periods / 2), clocks - nudge, clocks + nudge)
+
+
+def linear_nudge(clocks, periods, nudge):
+    return clocks + nudge
+
+
+# The nudge shrinks as the clock gets closer to the period
+def phase_response_nudge(clocks, periods, nudge):
+    delta = periods - clocks
+    return clocks + (0.01 * delta * nudge)
+
+
+register_update_rule('increment', increment_clocks)
+register_update_rule('strogatzian', strogatzian_clocks, integral=False)
+
+register_nudge_rule('symmetric', symmetric_nudge)
+register_nudge_rule('adversarial', adversarial_nudge)
+register_nudge_rule('linear', linear_nudge)
+register_nudge_rule('phase_response', phase_response_nudge, integral=False)
+
+
+# The rules used by a population (given the rule name of every firefly), in the order
+# of their codes, and the array of the code of every firefly
+def population_rules(registry, rule_per_firefly):
+    names = set(rule_per_firefly)
+    unknown = sorted(name for name in names if name not in registry)
+    if unknown:
+        raise ValueError("Unknown clock rules: {0}".format(", ".join(unknown)))
+    rules = sorted((registry[name] for name in names), key=lambda rule: rule.code)
+    lookup = dict((rule.name, rule.code) for rule in rules)
+    codes = np.array([lookup[name] for name in rule_per_firefly], dtype=np.int16)
+    return rules, codes
+
+
+# Whether clocks following all the given rules stay integral
+def keeps_integral(rules):
+    return all(rule.integral for rule in rules)
+
+
+# Apply to the fireflies at indices the rule of their code, one rule at a time
+def apply_rules(rules, codes, indices, clocks, periods, *extra):
+    if len(rules) == 1:
+        clocks[indices] = rules[0].function(clocks[indices], periods[indices], *extra)
+        return
+
+    selected = codes[indices]
+    for rule in rules:
+        members = indices[selected == rule.code]
+        if len(members) > 0:
+            clocks[members] = rule.function(clocks[members], periods[members], *extra)
@@ -0,0 +1,156 @@
+# File which includes the writers of the per-iteration simulation log
+#
+# A run log receives one row per simulation step: iteration, mean and std of the clocks,
+# number of fireflies which flashed and the phase metric. Rows are buffered and written
+# every flush_every rows, and with every=k only every k-th iteration is kept.
+
+import os
+import numpy as np
+from time import strftime
+
+columns = ('iteration', 'mean', 'std', 'num', 'phase_metric')
+column_types = ('<i8', '<f8', '<f8', '<i8', '<f8')
+
+
+# Default location of a log started now
+def default_log_path(extension=''):
+    return "logs/log__" + strftime("%d%m%Y_%H%M%S") + extension
+
+
+class RunLog:
+    def __init__(self, path=None, flush_every=1000, every=1):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.every = max(1, every)
+        self.rows = []
+        self.flushes = 0
+
+    # Start the log with the free-text parameter header of the simulation
+    def open(self, param_string):
+        raise NotImplementedError
+
+    # Whether the row of an iteration is kept by the decimation (for an array of iterations,
+    # whether the row of each of them is)
+    def keeps(self, iteration):
+        return iteration % self.every == 0
+
+    # Add the row of one iteration (dropped unless the iteration is kept by the decimation)
+    def write(self, iteration, mean, std, num, phase_metric):
+        if not self.keeps(iteration):
+            return
+        self.rows.append((iteration, mean, std, num, phase_metric))
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    # Add the rows of a block of iterations at once, given as arrays
+    def write_block(self, iterations, means, stds, nums, phase_metrics):
+        keep = self.keeps(np.asarray(iterations))
+        block = [np.asarray(values)[keep].tolist() for values in (iterations, means, stds, nums, phase_metrics)]
+        self.rows.extend(zip(*block))
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    # Write out the buffered rows
+    def flush(self):
+        if self.rows:
+            self.write_rows(self.rows)
+            self.rows = []
+            self.flushes += 1
+
+    # Private method to write the buffered rows to the file
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+# The human readable log: a parameter line, a separator and comma separated rows
+class CSVRunLog(RunLog):
+    def __init__(self, path=None, flush_every=1000, every=1):
+        RunLog.__init__(self, path=path, flush_every=flush_every, every=every)
+        self.f = None
+
+    def open(self, param_string):
+        if self.path is None:
+            self.path = default_log_path(".csv")
+        self.f = open(self.path, 'a+')
+        self.f.write(param_string)
+        self.f.write("---------------------------------------------------\n")
+        self.f.write(",".join(columns) + "\n")
+        self.f.flush()
+
+    def write_rows(self, rows):
+        self.f.write("".join("{0},{1},{2},{3},{4}\n".format(*row) for row in rows))
+        self.f.flush()
+
+    def close(self):
+        RunLog.close(self)
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+# The compact log: a directory with the parameter line in params.txt and every column
+# appended as raw little-endian values to <column>.bin, which can be memory-mapped back
+class BinaryRunLog(RunLog):
+    def __init__(self, path=None, flush_every=10000, every=1):
+        RunLog.__init__(self, path=path, flush_every=flush_every, every=every)
+        self.files = []
+
+    def open(self, param_string):
+        if self.path is None:
+            self.path = default_log_path()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, "params.txt"), 'w') as f:
+            f.write(param_string)
+        self.files = [open(os.path.join(self.path, column + ".bin"), 'ab') for column in columns]
+
+    def write_rows(self, rows):
+        for k, values in enumerate(zip(*rows)):
+            np.asarray(values, dtype=column_types[k]).tofile(self.files[k])
+            self.files[k].flush()
+
+    def close(self):
+        RunLog.close(self)
+        for f in self.files:
+            f.close()
+        self.files = []
+
+
+# Read a binary log back: the parameter line and a dictionary of (memory-mapped) columns
+def read_binary_log(path):
+    with open(os.path.join(path, "params.txt")) as f:
+        param_string = f.read()
+
+    data = {}
+    for column, column_type in zip(columns, column_types):
+        filename = os.path.join(path, column + ".bin")
+        if os.path.getsize(filename) == 0:
+            data[column] = np.zeros(0, dtype=column_type)
+        else:
+            data[column] = np.memmap(filename, dtype=column_type, mode='r')
+    return param_string, data
+
+
+# Write a whole log in the binary format at once, from a dictionary of columns
+def write_binary_log(path, param_string, data):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, "params.txt"), 'w') as f:
+        f.write(param_string)
+    for column, column_type in zip(columns, column_types):
+        np.asarray(data[column], dtype=column_type).tofile(os.path.join(path, column + ".bin"))
+
+
+# Build the log writer asked for by start_simulation: a RunLog is used as it is,
+# 'csv' and 'binary' pick the format, None turns logging off
+def make_run_log(log):
+    if log is None or isinstance(log, RunLog):
+        return log
+    if log == 'csv':
+        return CSVRunLog()
+    if log == 'binary':
+        return BinaryRunLog()
+    raise ValueError("Unknown run log: {0}".format(log))
@@ -0,0 +1,126 @@
+# File which includes the stop criteria of the simulation loop
+#
+# start_simulation checks its stop criteria at the end of every step (and after every
+# block of skipped idle ticks) and stops as soon as one of them is met. A criterion which
+# stopped the run tells the tick at which the run entered the state it detected
+# (entered_at) and the length in ticks of the cycle the run settled into (cycle_length).
+
+import numpy as np
+from hashlib import sha1
+
+
+class StopCriterion:
+    def __init__(self):
+        self.entered_at = None
+        self.cycle_length = None
+        self.stopped_at = None
+
+    # Called when a run starts
+    def reset(self, sim):
+        self.entered_at = None
+        self.cycle_length = None
+        self.stopped_at = None
+
+    # Called after every step, with the number of fireflies which flashed in it
+    # This method returns True when the run should stop
+    def check(self, sim, flashes):
+        raise NotImplementedError
+
+
+# Kuramoto order parameter r = |mean(exp(2 pi i clock / period))|, 1 when every firefly
+# is at the same phase. Stops once r stayed at or above threshold for window ticks.
+# The cycle length is the mean interval between the flashes of a firefly during the window.
+class OrderParameter(StopCriterion):
+    def __init__(self, threshold=0.99, window=1000):
+        StopCriterion.__init__(self)
+        self.threshold = threshold
+        self.window = window
+        self.r = None
+        self.flashes = 0
+
+    def reset(self, sim):
+        StopCriterion.reset(self, sim)
+        self.r = None
+        self.flashes = 0
+
+    def check(self, sim, flashes):
+        clocks, periods = sim.get_clock_state()
+        if len(clocks) == 0:
+            return False
+        self.r = abs(np.exp(2j * np.pi * clocks / periods).mean())
+
+        if self.r < self.threshold:
+            self.entered_at = None
+            self.flashes = 0
+            return False
+
+        if self.entered_at is None:
+            self.entered_at = sim.time
+            self.flashes = 0
+            return False
+
+        self.flashes += flashes
+        held = sim.time - self.entered_at
+        if held < self.window:
+            return False
+
+        self.cycle_length = float(held) * len(clocks) / self.flashes if self.flashes > 0 else None
+        self.stopped_at = sim.time
+        return True
+
+
+# Stops when the clocks come back to a state they were in before. Without movement the
+# next state only depends on the clocks, so from then on the run repeats itself.
+# Every state is compared with the kept ones, which are kept as their SHA-1 digest with the
+# tick they were seen at (about 230 bytes each), at most max_states of them: the states of
+# every check at first, then, once the table is full, of every 2nd check, every 4th, and so
+# on (the others are dropped). The cycle length is always exact. While every state is kept
+# the run stops at the first repeat, and entered_at is the first state of the cycle; after
+# that, both can be up to `stride` checks late. The table takes at most about 16 MB.
+class CycleDetector(StopCriterion):
+    def __init__(self, max_states=65536):
+        StopCriterion.__init__(self)
+        self.max_states = max(1, max_states)
+        self.seen = None
+        self.stride = 1
+        self.checks = 0
+
+    def reset(self, sim):
+        if sim.movement:
+            raise ValueError("Cycles can't be detected in simulations with movement")
+        StopCriterion.reset(self, sim)
+        self.seen = {}
+        self.stride = 1
+        self.checks = 0
+
+    def check(self, sim, flashes):
+        clocks, periods = sim.get_clock_state()
+        state = sha1(clocks.tobytes()).digest()
+        kept = self.seen.get(state)
+        if kept is None:
+            self.checks += 1
+            if self.checks % self.stride == 0:
+                self.keep(state, sim.time)
+            return False
+
+        first_seen = kept[0]
+        self.entered_at = first_seen
+        self.cycle_length = sim.time - first_seen
+        self.stopped_at = sim.time
+        return True
+
+    # Private method to keep the digest of a state, thinning the kept ones when there are too many
+    def keep(self, state, time):
+        self.seen[state] = (time, self.checks)
+        while len(self.seen) > self.max_states:
+            self.stride *= 2
+            self.seen = dict((digest, kept) for digest, kept in self.seen.items() if kept[1] % self.stride == 0)
+
+
+# Build the stop criteria asked for by start_simulation: None, a criterion or a list of them
+def make_stop_criteria(stop):
+    if stop is None:
+        return []
+    if isinstance(stop, StopCriterion):
+        return [stop]
+    return list(stop)
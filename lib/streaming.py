@@ -0,0 +1,135 @@
+# File which includes the streaming interface of the simulation
+#
+# FirefliesSimulation.stream runs the simulation loop as a generator of TickStats records,
+# one per tick (or one every k ticks), so a run can be followed while it goes instead of
+# tailing its log. The run only advances as records are taken from it, and closing the
+# generator (or leaving a for loop over it) ends the run, e.g.
+#
+#   for record in sim.stream(until=100000, every=100):
+#       print(record.time, record.phase_metric)
+#
+# StreamHub follows several running simulations from an asyncio event loop. Every stream
+# runs in its own thread and hands its records over through a buffer of at most maxsize
+# records: when the consumer falls behind, the simulation waits for it (backpressure) or,
+# with drop=True, keeps running and drops the records which don't fit. The event loop itself
+# never waits for a simulation. asyncio is only imported once a hub is made.
+#
+# A hub belongs to the event loop it is first used from: streams added before that loop runs
+# (e.g. before asyncio.run) start once get() is first called from it.
+
+import threading
+from collections import namedtuple
+
+# Stats of one tick: time, mean and std of the clocks, number of fireflies which flashed,
+# phase metric and the (ascending) indices of the fireflies which flashed, when asked for
+TickStats = namedtuple('TickStats', ('time', 'mean', 'std', 'flashes', 'phase_metric', 'flashed'))
+
+
+class StreamHub:
+    def __init__(self, maxsize=100, drop=False):
+        self.loop = None
+        self.queue = None
+        self.maxsize = max(1, maxsize)
+        self.drop = drop
+        self.running = 0
+        self.slots = {}
+        self.stopping = {}
+        self.dropped = {}
+        self.errors = {}
+        self.threads = {}
+        self.waiting = []
+
+    # Start streaming a simulation, under a name its records are tagged with
+    # The options are those of FirefliesSimulation.stream
+    def add(self, name, simulation, **options):
+        if name in self.threads:
+            raise ValueError("A stream named {0} was already added".format(name))
+        self.slots[name] = threading.Semaphore(self.maxsize)
+        self.stopping[name] = threading.Event()
+        self.dropped[name] = 0
+        thread = threading.Thread(target=self.follow, args=(name, simulation, options))
+        thread.daemon = True
+        self.threads[name] = thread
+        self.running += 1
+        self.waiting.append(thread)
+        if running_loop() is not None:
+            self.bind()
+
+    # Future of the next (name, record) of any stream, to be awaited in the hub's event loop
+    # The record is None once the stream ended; running counts the streams which didn't
+    def get(self):
+        import asyncio
+        self.bind()
+        future = asyncio.ensure_future(self.queue.get())
+        future.add_done_callback(self.release)
+        return future
+
+    # Private method to attach the hub to the running event loop and start the waiting streams
+    def bind(self):
+        import asyncio
+        loop = running_loop()
+        if loop is None:
+            raise RuntimeError("StreamHub.get() has to be called from a running event loop")
+        if self.loop is None:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+        elif self.loop is not loop:
+            raise RuntimeError("This StreamHub is already used from another event loop")
+
+        waiting = self.waiting
+        self.waiting = []
+        for thread in waiting:
+            thread.start()
+
+    # Ask a stream (or all of them) to end after its current tick
+    def stop(self, name=None):
+        for key in ([name] if name is not None else list(self.stopping)):
+            self.stopping[key].set()
+
+    # Private method to free the slot of a record handed to the consumer
+    def release(self, future):
+        if future.cancelled():
+            return
+        name, record = future.result()
+        if record is None:
+            self.running -= 1
+        else:
+            self.slots[name].release()
+
+    # Private method to run a stream in its thread
+    def follow(self, name, simulation, options):
+        slots = self.slots[name]
+        stopping = self.stopping[name]
+        records = simulation.stream(**options)
+        try:
+            for record in records:
+                if stopping.is_set():
+                    break
+                if not self.take_slot(slots, stopping):
+                    self.dropped[name] += 1
+                    continue
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, (name, record))
+        except Exception as error:
+            self.errors[name] = error
+        finally:
+            records.close()
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (name, None))
+
+    # Private method to wait for room in a stream's buffer (unless records are dropped)
+    # This method returns whether the record can be handed over
+    def take_slot(self, slots, stopping):
+        if self.drop:
+            return slots.acquire(False)
+        while not stopping.is_set():
+            if slots.acquire(True, 0.1):
+                return True
+        return False
+
+
+# The event loop running in this thread, if any
+def running_loop():
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
@@ -0,0 +1,96 @@
+# File which includes the runner of parameter sweeps
+#
+# A sweep runs one simulation per combination of parameter values (a cell of the grid)
+# on a pool of worker processes. Every cell gets its own seed, derived from its
+# parameters, so a cell gives the same result however the sweep is scheduled.
+# Results are appended to a CSV table as cells finish; a sweep started again on the
+# same table skips the cells which are already in it.
+# With a warm start checkpoint every cell starts from the fireflies saved in it.
+
+import csv
+import os
+import random
+from hashlib import md5
+from itertools import product
+from multiprocessing import Pool
+from time import time
+
+result_columns = ['seed', 'synchronized_at', 'phase_metric', 'ticks', 'seconds']
+
+
+# All combinations of the values in grid (parameter name -> list of values)
+def sweep_configurations(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in product(*[grid[name] for name in names])]
+
+
+# Key identifying a cell of the sweep in the results table
+def config_key(config):
+    return ",".join("{0}={1}".format(name, config[name]) for name in sorted(config))
+
+
+# Seed of a cell, stable across runs of the sweep
+def task_seed(base_seed, config):
+    digest = md5(config_key(config).encode('utf-8')).hexdigest()
+    return (int(digest[:8], 16) + base_seed) % (2 ** 32)
+
+
+# Keys of the cells already recorded in a results table
+def finished_keys(results_path, names):
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path) as f:
+        return set(config_key(dict((name, row[name]) for name in names)) for row in csv.DictReader(f))
+
+
+# Run the simulation of one cell (in a worker process)
+def run_configuration(task):
+    simulation_class, config, seed, until, vectorized, warm_start = task
+    random.seed(seed)
+
+    started = time()
+    sim = simulation_class(**config)
+    if warm_start is not None:
+        sim.restore_checkpoint(warm_start, warm_start=True)
+    sim.start_simulation(until=until, vectorized=vectorized, log=None, verbose=False)
+
+    result = dict(config)
+    result['seed'] = seed
+    result['synchronized_at'] = '' if sim.synchronized_at is None else sim.synchronized_at
+    result['phase_metric'] = sim.phase_metric
+    result['ticks'] = sim.time
+    result['seconds'] = round(time() - started, 3)
+    return result
+
+
+# Run every cell of grid not yet in results_path and append their results to it
+# simulation_class is called with the parameters of a cell as keyword arguments
+# warm_start is a checkpoint (see lib.checkpoint) with as many fireflies as every cell
+# This method returns the number of cells which were run
+def run_sweep(simulation_class, grid, results_path, until=100000, processes=None, seed=0, vectorized=True,
+              warm_start=None):
+    names = sorted(grid)
+    done = finished_keys(results_path, names)
+    tasks = [(simulation_class, config, task_seed(seed, config), until, vectorized, warm_start)
+             for config in sweep_configurations(grid)
+             if config_key(config) not in done]
+    if not tasks:
+        return 0
+
+    write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+    pool = Pool(processes)
+    try:
+        with open(results_path, 'a') as f:
+            writer = csv.DictWriter(f, fieldnames=names + result_columns)
+            if write_header:
+                writer.writeheader()
+            for result in pool.imap_unordered(run_configuration, tasks):
+                writer.writerow(result)
+                f.flush()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return len(tasks)